@@ -5,6 +5,7 @@ import cv2
 import numpy as np
 from pydub import AudioSegment
 import os
+import time
 import random
 from dataclasses import dataclass
 import pickle
@@ -13,6 +14,7 @@ import click
 from config import *
 from app.util import *
 from app.movie import *
+from app.scan import *
 
 
 @click.command()
@@ -23,53 +25,67 @@ from app.movie import *
 @click.option("--height", "-h", default=480, help="Height of output video.")
 @click.option("--fps", "-f", default=30, help="FPS of output video.")
 @click.option("-d", is_flag=True, help="Cluster and order files by date.")
-def main(inputdir, music, out, width, height, fps, d):
+@click.option("--recursive", "-r", is_flag=True, help="Include images and videos in subdirectories of input directory.")
+@click.option("--score", "-s", is_flag=True,
+              help="With -d, keep the best photo of each cluster (by sharpness, exposure and faces), not the first.")
+@click.option("--workers", "-j", default=os.cpu_count(),
+              help="Number of threads to render frames (and score photos) on.")
+@click.option("--plan", "-p", default=None, help="File to reuse slide plan from, or to save it to if it doesn't exist.")
+@click.option("--memory", default=MEMORY_BUDGET // 1024**2, help="Max MB of decoded images to keep in memory.")
+@click.option("--prefetch", default=4, help="Number of slides to decode ahead of the one being rendered.")
+@click.option("--preview", is_flag=True, help="Render quick low-resolution draft, with the same slide timing.")
+@click.option("--incremental", is_flag=True, help="Reuse encoded slides that are unchanged since a previous render.")
+@click.option("--transition", "-t", default="cut", type=click.Choice(["cut", *TRANSITIONS]),
+              help="Transition between slides.")
+@click.option("--transition-duration", default=300, help="Duration of transitions in ms.")
+@click.option("--profile", is_flag=True, help="Print time spent in each stage, and save report and cProfile stats.")
+def main(inputdir, music, out, width, height, fps, d, recursive, score, workers, plan, memory, prefetch, preview,
+         incremental, transition, transition_duration, profile):
     """ Main function for creating movie. """
 
     # Convert to absolute paths
     inputdir = os.path.join(MEDIADIR, inputdir)
     music = [os.path.join(AUDIODIR, m) for m in music]
     out = os.path.join(OUTDIR, out)
+    plan = os.path.join(OUTDIR, plan) if plan else None
 
-    # Load music files
-    musics = []
-    for path in music:
-        if os.path.isdir(path):
-            for file in os.listdir(path):
-                if is_audio(fp := os.path.join(path, file)):
-                    musics.append(AudioSegment.from_file(fp))
-        elif is_audio(path):
-            musics.append(AudioSegment.from_file(path))
+    # Timers of each stage are always collected, but only reported when profiling
+    profiler = Profiler(cprofile=profile)
+    profiler.start()
 
-    # Preload image and video files from input directory
-    files: list[MediaFile] = []
-    for file in os.listdir(inputdir):
-        path = os.path.join(inputdir, file)
-        if is_image(path):
-            files.append(ImageFile(path))
-        elif is_video(path):
-            files.append(VideoFile(path))
-        else:
-            print(f"Warning: Unknown file type: {path}")
-    print(f"Total # of photos and videos: {len(files)}")
+    # Load music files and their (cached) beats
+    music_paths = scan_music(music)
+    with profiler.stage("decode music", len(music_paths), "tracks"):
+        musics = [AudioSegment.from_file(path) for path in music_paths]
+    with profiler.stage("analyze music", len(music_paths), "tracks"):
+        beats = [load_beats(path, audio) for path, audio in zip(music_paths, musics)]
 
-    if d:
-        # Sort and cluster files by date
-        clusters = cluster_files_by_date(files)
-        print(f"      # of clusters: {len(clusters)}")
+    # Find image and video files in input directory, and their dates
+    start = time.perf_counter()
+    files = scan_media(inputdir, recursive=recursive)
+    seconds = time.perf_counter() - start
+    profiler.add("scan directory", seconds, len(files), "files")
+    print(f"Scanned {len(files)} files in {seconds:.2f}s ({len(files) / max(seconds, 1e-9):.0f} files/s)")
+    print(f"Total # of photos and videos: {len(files)}")
 
-        # Choose representative files from each cluster
-        files = [file for cluster in clusters for file in choose_representatives(cluster)]
-    else:
-        # Sort files by name (assumes files are named sequentially)
-        files = sorted(files, key=lambda file: int(file.name))
+    with profiler.stage("order files", len(files), "files"):
+        files = order_files(files, by_date=d, scorer=Scorer() if score else None, workers=workers)
 
     # Create movie object
     print(f"Final # of photos and videos: {len(files)}")
-    movie = Movie(files, musics, width, height, fps)
+    movie = Movie(files, musics, width, height, fps, beats=beats, memory_budget=memory * 1024**2,
+                  profiler=profiler, transition=transition, transition_duration=transition_duration)
 
     # Create movie
-    movie.export(out)
+    movie.export(out, workers=workers, plan_path=plan, prefetch=prefetch, preview=preview,
+                 incremental=incremental)
+
+    if profile:
+        # Summary table, and report (and cProfile stats) next to output video
+        profiler.stop()
+        print(profiler.summary())
+        profiler.save(report := f"{os.path.splitext(out)[0]}.profile.json")
+        print(f"Saved profile to {report}")
 
 
 if __name__ == "__main__":
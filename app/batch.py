@@ -0,0 +1,296 @@
+""" Batch mode: render queued movies in one long-running process, sharing caches and rendering threads. """
+
+from pydub import AudioSegment
+import os
+import glob
+import json
+import time
+import threading
+import traceback
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+import click
+
+from config import *
+from app.util import *
+from app.movie import *
+from app.scan import *
+
+
+MUSIC_BUDGET = 1024**3  # Max bytes of decoded music to keep between jobs
+
+
+def resolve(directory: str, path: str) -> str:
+    """
+    Return path of a job (relative to directory) as an absolute path, rejecting paths that point outside of directory
+    (absolute paths, or ones with ".."), so jobs can only read and write where the CLI would.
+    """
+    directory = os.path.abspath(directory)
+    full = os.path.abspath(os.path.join(directory, path))
+    if os.path.commonpath([directory, full]) != directory:
+        raise ValueError(f"Path is outside of {directory}: {path}")
+    return full
+
+
+@dataclass
+class Job:
+    """ Spec of a movie to render, with the same options (and paths relative to the same directories) as the CLI. """
+
+    inputdir: str
+    music: list[str]
+    out: str
+    width: int = 640
+    height: int = 480
+    fps: int = 30
+    d: bool = False  # Cluster and order files by date
+    recursive: bool = False
+    score: bool = False  # Keep best image of each cluster, instead of first
+    plan: str = None
+    preview: bool = False
+    incremental: bool = False
+    transition: str = "cut"
+    transition_duration: int = 300
+
+    @classmethod
+    def from_json(cls, text: str) -> 'Job':
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError(f"Job must be a JSON object, not {type(data).__name__}")
+        if isinstance(data.get("music"), str):
+            data["music"] = [data["music"]]
+        return cls(**data)
+
+
+class MusicLibrary:
+    """
+    Decoded music tracks and their beats, shared between jobs; each track is only decoded once while unchanged.
+    Tracks are kept within a budget of decoded bytes, releasing the least recently used ones (tracks that jobs are
+    still using stay alive in those jobs until they finish).
+    """
+
+    def __init__(self, budget: int = MUSIC_BUDGET):
+        self.budget = budget
+        self.nbytes = 0
+        # Path -> (size and mtime, future of audio and beats), least recently used first
+        self.tracks: OrderedDict[str, tuple[tuple, Future]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> tuple[AudioSegment, Beats]:
+        """ Return decoded music file and its beats, decoding it only if no other job has (or is doing so). """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            entry = self.tracks.get(path)
+            owner = entry is None or entry[0] != version
+            if owner:
+                self._remove(path)  # Outdated version (if any)
+                entry = self.tracks[path] = (version, Future())
+            self.tracks.move_to_end(path)
+        future = entry[1]
+
+        if owner:
+            try:
+                audio = AudioSegment.from_file(path)
+                future.set_result((audio, load_beats(path, audio)))
+            except Exception as e:
+                with self.lock:
+                    if self.tracks.get(path) is entry:
+                        del self.tracks[path]  # Retry on next job
+                future.set_exception(e)
+            else:
+                with self.lock:
+                    if self.tracks.get(path) is entry:
+                        self.nbytes += len(audio.raw_data)
+                        self._evict(keep=path)
+        return future.result()
+
+    def _remove(self, path: str):
+        """ Remove track from library. """
+        if (entry := self.tracks.pop(path, None)) is not None and entry[1].done() and not entry[1].exception():
+            self.nbytes -= len(entry[1].result()[0].raw_data)
+
+    def _evict(self, keep: str):
+        """ Remove least recently used decoded tracks while over budget (except track keep). """
+        for path in list(self.tracks):
+            if self.nbytes <= self.budget:
+                break
+            if path != keep and self.tracks[path][1].done():
+                self._remove(path)
+
+
+class BatchServer:
+    """
+    Render movies from a queue of jobs, a few at a time, in one process.
+    Jobs are JSON files in a queue directory (claimed by renaming them, so several servers can share a directory),
+    or lines of JSON sent to a Unix socket. All jobs share the media cache (metadata and thumbnails), decoded music
+    and beats, and one pool of rendering threads, so the total number of rendering threads stays within budget.
+    """
+
+    def __init__(self, queue_dir: str = None, socket_path: str = None, workers: int = os.cpu_count(), jobs: int = 2,
+                 prefetch: int = 4, memory_budget: int = MEMORY_BUDGET, music_budget: int = MUSIC_BUDGET):
+        """
+        :param queue_dir: directory to take job files (*.json) from
+        :param socket_path: path of Unix socket to take jobs from
+        :param workers: number of rendering threads, shared by all jobs
+        :param jobs: max number of jobs to run at once
+        :param prefetch: number of slides each job decodes ahead of the one being rendered
+        :param memory_budget: max bytes of decoded images to keep in memory, shared by all jobs
+        :param music_budget: max bytes of decoded music to keep between jobs
+        """
+        self.queue_dir = queue_dir
+        self.socket_path = socket_path
+        self.workers = workers
+        self.prefetch = prefetch
+        self.jobs = jobs
+        self.memory_budget = MemoryBudget(memory_budget)
+
+        self.cache = MediaCache()
+        self.music = MusicLibrary(music_budget)
+        self.render_executor = ThreadPoolExecutor(workers, thread_name_prefix="render")
+        self.job_executor = ThreadPoolExecutor(jobs, thread_name_prefix="job")
+        self.slots = threading.Semaphore(jobs)  # Jobs are only taken from the queue when they can start
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def run(self, job: Job):
+        """ Render movie of job (on a job thread). """
+        inputdir = resolve(MEDIADIR, job.inputdir)
+        music = [resolve(AUDIODIR, m) for m in job.music]
+        out = resolve(OUTDIR, job.out)
+        plan = resolve(OUTDIR, job.plan) if job.plan else None
+
+        tracks = [self.music.get(path) for path in scan_music(music)]
+        # Scanning and scoring run on the shared rendering threads too, so jobs stay within the thread budget
+        files = order_files(scan_media(inputdir, recursive=job.recursive, executor=self.render_executor),
+                            by_date=job.d, scorer=Scorer() if job.score else None, cache=self.cache,
+                            executor=self.render_executor)
+        movie = Movie(files, [audio for audio, _ in tracks], job.width, job.height, job.fps,
+                      beats=[beats for _, beats in tracks], cache=self.cache, memory_budget=self.memory_budget,
+                      transition=job.transition, transition_duration=job.transition_duration)
+        movie.export(out, workers=self.workers, plan_path=plan, prefetch=self.prefetch, preview=job.preview,
+                     incremental=job.incremental, executor=self.render_executor)
+
+    def submit(self, job: Job, name: str) -> Future:
+        """ Start job once a slot is free; return future of its completion. """
+        self.slots.acquire()
+        with self.lock:
+            self.running += 1
+        print(f"Starting job {name}")
+
+        def run():
+            start = time.perf_counter()
+            try:
+                self.run(job)
+                print(f"Finished job {name} in {time.perf_counter() - start:.1f}s")
+            except Exception:
+                print(f"Job {name} failed:\n{traceback.format_exc()}")
+                raise
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self.slots.release()
+        return self.job_executor.submit(run)
+
+    def claim(self) -> str:
+        """ Claim next job file in queue directory, by renaming it; return its new path, or None if queue is empty. """
+        for path in sorted(glob.glob(os.path.join(self.queue_dir, "*.json"))):
+            try:
+                os.rename(path, running := f"{path}.running")
+                return running
+            except OSError:
+                continue  # Claimed by another server
+        return None
+
+    def serve_directory(self, poll: float = 2, once: bool = False):
+        """
+        Run jobs from queue directory; each job file is renamed to *.done or *.failed when finished (with the error
+        written to *.error).
+        :param poll: seconds between checks of the queue directory when it is empty
+        :param once: return once the queue directory is empty and all jobs are finished, instead of waiting for more
+        """
+        def finish(running: str, future: Future):
+            path = running.removesuffix(".running")
+            if (error := future.exception()) is not None:
+                with open(f"{path}.error", "w") as f:
+                    f.write("".join(traceback.format_exception(error)))
+            os.rename(running, f"{path}.{'failed' if error is not None else 'done'}")
+
+        while True:
+            # Only claim a job when it can start, so other servers can take it otherwise
+            with self.lock:
+                busy = self.running >= self.jobs
+            if busy or (running := self.claim()) is None:
+                with self.lock:
+                    idle = self.running == 0
+                if once and idle:
+                    return
+                time.sleep(0.1 if busy else poll)
+                continue
+            try:
+                with open(running) as f:
+                    job = Job.from_json(f.read())
+            except Exception as e:  # (a bad job file fails, without stopping the server)
+                future = Future()
+                future.set_exception(e)
+                finish(running, future)
+                continue
+            future = self.submit(job, os.path.basename(running).removesuffix(".json.running"))
+            future.add_done_callback(lambda future, running=running: finish(running, future))
+
+    def serve_socket(self):
+        """ Run jobs sent to Unix socket, one JSON job per line; replies "done" or "failed: <error>" to each. """
+        batch = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        batch.submit(Job.from_json(line), f"from socket ({line.strip()[:40].decode()}...)").result()
+                        reply = "done"
+                    except Exception as e:
+                        reply = f"failed: {e}"
+                    self.wfile.write(f"{reply}\n".encode())
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        with socketserver.ThreadingUnixStreamServer(self.socket_path, Handler) as server:
+            server.daemon_threads = True
+            server.serve_forever()
+
+    def close(self):
+        self.job_executor.shutdown()
+        self.render_executor.shutdown()
+        self.cache.close()
+
+
+@click.command()
+@click.option("--queue", "-q", default=None, help="Directory of job files (*.json) to render.")
+@click.option("--socket", "-s", "socket_path", default=None, help="Unix socket to receive jobs on (one JSON per line).")
+@click.option("--workers", "-j", default=os.cpu_count(), help="Number of threads to render frames on, for all jobs.")
+@click.option("--jobs", default=2, help="Max number of jobs to render at once.")
+@click.option("--memory", default=MEMORY_BUDGET // 1024**2, help="Max MB of decoded images in memory, for all jobs.")
+@click.option("--music-memory", default=MUSIC_BUDGET // 1024**2, help="Max MB of decoded music to keep between jobs.")
+@click.option("--prefetch", default=4, help="Number of slides to decode ahead of the one being rendered, per job.")
+@click.option("--once", is_flag=True, help="Exit once the queue directory is empty, instead of waiting for more jobs.")
+def main(queue, socket_path, workers, jobs, memory, music_memory, prefetch, once):
+    """ Render queued movies, sharing caches and rendering threads between them. """
+    if queue is None and socket_path is None:
+        raise click.UsageError("Give a queue directory (--queue), a socket (--socket), or both.")
+
+    server = BatchServer(queue, socket_path, workers, jobs, prefetch, memory * 1024**2, music_memory * 1024**2)
+    try:
+        if socket_path is not None and queue is not None:
+            threading.Thread(target=server.serve_socket, daemon=True).start()
+        if queue is not None:
+            server.serve_directory(once=once)
+        else:
+            server.serve_socket()
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+
+import numpy as np
+from pydub import AudioSegment
+from scipy.signal import find_peaks
+from scipy.ndimage import uniform_filter1d
+import os
+import hashlib
+from dataclasses import dataclass
+
+from config import *
+
+
+HOP_MS = 10  # Time between frames of onset envelope in ms
+CHUNK_FRAMES = 4096  # Number of STFT frames to compute at a time (bounds memory on long tracks)
+MIN_BPM, MAX_BPM = 60, 200  # Range of tempos considered
+PRIOR_BPM = 120  # Tempo that is most likely a priori
+TIGHTNESS = 100  # How strongly beats are kept to the tempo (vs. following onsets)
+
+
+def onset_envelope(audio: AudioSegment) -> np.ndarray:
+    """
+    Compute onset strength of audio every HOP_MS, as spectral flux: the increase in log-magnitude spectrum from
+    the previous frame, summed over frequencies.
+    :return: onset strength of each frame (frame i is centered at i * HOP_MS)
+    """
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[audio.sample_width]
+    samples = np.frombuffer(audio.raw_data, dtype=dtype).reshape(-1, audio.channels)
+    mono = samples.mean(axis=1, dtype=np.float32) / audio.max_possible_amplitude
+
+    hop = audio.frame_rate * HOP_MS // 1000
+    n_fft = 1 << int(np.ceil(np.log2(4 * hop)))  # ~40 ms window
+    mono = np.pad(mono, n_fft // 2)  # Center frames on their times
+    n_frames = max(0, 1 + (len(mono) - n_fft) // hop)
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop][:n_frames]
+    window = np.hanning(n_fft).astype(np.float32)
+
+    flux = np.zeros(n_frames, dtype=np.float32)
+    previous = None
+    for i in range(0, n_frames, CHUNK_FRAMES):
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(frames[i: i + CHUNK_FRAMES] * window, axis=1)))
+        if previous is not None:
+            spectrum = np.concatenate([previous, spectrum])
+        diff = np.maximum(np.diff(spectrum, axis=0), 0).sum(axis=1)
+        flux[i + (previous is None): i + CHUNK_FRAMES] = diff
+        previous = spectrum[-1:]
+
+    # Remove slowly varying loudness, keeping only sudden increases
+    return np.maximum(flux - uniform_filter1d(flux, int(500 / HOP_MS)), 0)
+
+
+def estimate_period(onsets: np.ndarray) -> int:
+    """ Estimate beat period (in frames) from autocorrelation of onset envelope, weighted towards PRIOR_BPM. """
+    n = len(onsets)
+    spectrum = np.fft.rfft(onsets - onsets.mean(), 2 * n)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    lags = np.arange(int(60000 / MAX_BPM / HOP_MS), min(n, int(60000 / MIN_BPM / HOP_MS) + 1))
+    bpm = 60000 / (lags * HOP_MS)
+    prior = np.exp(-0.5 * (np.log2(bpm / PRIOR_BPM) / 0.9) ** 2)  # Log-Gaussian, ~1 octave wide
+    return int(lags[np.argmax(autocorrelation[lags] * prior)])
+
+
+def track_beats(onsets: np.ndarray, period: int) -> np.ndarray:
+    """
+    Find beats by dynamic programming (Ellis, 2007): each beat is placed on strong onsets, about one period after
+    the previous beat.
+    :return: frame indices of beats
+    """
+    onsets = onsets / (onsets.std() or 1)
+    score = onsets.astype(np.float64)
+    backlink = np.full(len(onsets), -1)
+    # Previous beat is between half and two periods before, penalized by how far its interval is from the period
+    offsets = np.arange(-2 * period, -(period // 2) + 1)
+    penalty = -TIGHTNESS * np.log(-offsets / period) ** 2
+    for t in range(period // 2, len(onsets)):
+        first = max(0, -(t + offsets[0]))  # Skip candidates before start of track
+        candidates = score[t + offsets[first]: t + offsets[-1] + 1] + penalty[first:]
+        best = np.argmax(candidates)
+        score[t] += candidates[best]
+        backlink[t] = t + offsets[first + best]
+
+    # Backtrack from best beat within last period
+    t = len(onsets) - period + np.argmax(score[-period:])
+    beats = []
+    while t >= 0:
+        beats.append(t)
+        t = backlink[t]
+    return np.array(beats[::-1], dtype=np.int64)
+
+
+@dataclass
+class Beats:
+    """ Beat grid of a music track, with the onset strength of each beat. """
+
+    times: np.ndarray  # Times of beats in ms
+    strengths: np.ndarray  # Strength of onset on each beat, from 0 (none) to 1 (strongest of track)
+    tempo: float  # Tempo in BPM (0 if no beats were found)
+    duration: float  # Duration of track in ms
+
+    @classmethod
+    def from_audio(cls, audio: AudioSegment) -> 'Beats':
+        """ Detect onsets and tempo of audio, and the beat grid that best fits them. """
+        onsets = onset_envelope(audio)
+        if len(onsets) < 2 * int(60000 / MIN_BPM / HOP_MS) or not onsets.any():
+            return cls(np.empty(0), np.empty(0), 0, len(audio))  # Too short or silent
+
+        # Beats follow the tempo, snapped to an onset peak if there is one within a frame
+        period = estimate_period(onsets)
+        beats = track_beats(onsets, period)
+        peaks, _ = find_peaks(onsets, height=np.percentile(onsets, 75), distance=max(1, period // 4))
+        if len(peaks):
+            right = np.minimum(np.searchsorted(peaks, beats), len(peaks) - 1)
+            left = np.maximum(right - 1, 0)
+            nearest = np.where(np.abs(peaks[left] - beats) < np.abs(peaks[right] - beats), peaks[left], peaks[right])
+            beats = np.where(np.abs(nearest - beats) <= 1, nearest, beats)
+
+        # Strength of each beat relative to strongest beats of the track
+        strengths = onsets[beats] / (np.percentile(onsets[beats], 95) or 1)
+        return cls(beats * float(HOP_MS), np.clip(strengths, 0, 1), 60000 / (period * HOP_MS), len(audio))
+
+    def save(self, path: str):
+        np.savez(path, times=self.times, strengths=self.strengths, tempo=self.tempo, duration=self.duration)
+
+    @classmethod
+    def load(cls, path: str) -> 'Beats':
+        with np.load(path) as data:
+            return cls(data["times"], data["strengths"], float(data["tempo"]), float(data["duration"]))
+
+
+def load_beats(path: str, audio: AudioSegment = None) -> Beats:
+    """
+    Load beats of music file, detecting them only if not already cached.
+    :param path: path of music file
+    :param audio: already decoded music file, or None to decode it if needed
+    :return: beats of music
+    """
+    # Cache key changes whenever the file is modified
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    cache_path = os.path.join(BEATSDIR, f"{key}.npz")
+
+    if os.path.isfile(cache_path):
+        return Beats.load(cache_path)
+
+    beats = Beats.from_audio(audio or AudioSegment.from_file(path))
+    os.makedirs(BEATSDIR, exist_ok=True)
+    beats.save(cache_path)
+    return beats
+
+
+def beat_grid(beats: list[Beats], duration: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return beats of the soundtrack, looping through the tracks (as the music does) until duration.
+    :param beats: beats of each music track, in order
+    :param duration: duration of soundtrack to cover in ms
+    :return: times of beats in ms, and their strengths
+    """
+    times, strengths = [], []
+    offset, i = 0, 0
+    while offset < duration and any(track.duration for track in beats):
+        track = beats[i % len(beats)]
+        times.append(track.times + offset)
+        strengths.append(track.strengths)
+        offset += track.duration
+        i += 1
+    if not times:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(times), np.concatenate(strengths)
@@ -0,0 +1,218 @@
+
+import cv2
+import numpy as np
+from pydub import AudioSegment
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, fields
+
+from config import *
+from app.util import *
+from app.media import *
+
+
+THUMBNAIL_SIZE = 100  # Width and height of thumbnails (same size Image.get_similarity compares at)
+THUMBNAIL_SHAPE = (THUMBNAIL_SIZE, THUMBNAIL_SIZE, 3)
+THUMBNAIL_BYTES = int(np.prod(THUMBNAIL_SHAPE))
+
+
+def frame_rate(rate: str) -> float:
+    """ Parse frame rate as reported by ffprobe (e.g. "30000/1001"), or 0 if unknown. """
+    num, den = rate.split("/")
+    return int(num) / int(den) if int(den) else 0
+
+
+@dataclass
+class MediaInfo:
+    """ Metadata of a media file, as stored in the cache. """
+
+    path: str
+    size: int  # Size of file in bytes, when info was computed
+    mtime: int  # Modification time of file in ns, when info was computed
+    width: int
+    height: int
+    creation_date: float
+
+    # Images only
+    sharpness: float = None  # Variance of laplacian of full image
+    histogram: np.ndarray = None  # Histogram of first channel of thumbnail
+    thumbnail: int = None  # Row of thumbnail in thumbnail array
+
+    # Videos only
+    duration: float = None  # Duration of video in ms
+    fps: float = None
+    audio_duration: float = None  # Duration of audio in ms, or None if video has no audio
+
+
+@dataclass
+class Scores:
+    """ Scores of an image (see score_image), as stored in the cache. """
+
+    sharpness: float  # Variance of laplacian of reduced-resolution image
+    exposure: float  # From 0 (all black, all white or clipped) to 1 (mid-grey on average, nothing clipped)
+    faces: int = None  # Number of faces found, or None if face detection was unavailable
+
+
+class MediaCache:
+    """
+    Persistent cache of media file metadata and thumbnails, so unchanged files are never decoded again.
+    Metadata is stored in SQLite, and thumbnails in a memory-mapped array; entries are invalidated when the size
+    or modification time of the file changes.
+    """
+
+    def __init__(self, directory: str = CACHEDIR):
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # (processes sharing the cache, e.g. batch servers, wait for each other's writes)
+        self.db = sqlite3.connect(os.path.join(directory, "media.db"), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, width INTEGER, height INTEGER,
+                creation_date REAL, sharpness REAL, histogram BLOB, thumbnail INTEGER,
+                duration REAL, fps REAL, audio_duration REAL)
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, sharpness REAL, exposure REAL, faces INTEGER)
+        """)
+        # Next free row of thumbnail file (allocated in the database, so processes never share a row)
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO counters VALUES ('thumbnails', "
+                        "(SELECT COALESCE(MAX(thumbnail) + 1, 0) FROM media))")
+        self.db.commit()
+        self.columns = [f.name for f in fields(MediaInfo)]
+
+        # Thumbnails are appended to a flat file, and memory-mapped for reading
+        self.thumbnails_path = os.path.join(directory, "thumbnails.bin")
+        open(self.thumbnails_path, "ab").close()
+        self.thumbnails = None
+        self._map_thumbnails()
+
+    def _map_thumbnails(self):
+        """ Memory-map thumbnail file (again, after it has grown). """
+        rows = os.path.getsize(self.thumbnails_path) // THUMBNAIL_BYTES
+        self.thumbnails = np.memmap(self.thumbnails_path, dtype=np.uint8, mode="r", shape=(rows, *THUMBNAIL_SHAPE)) \
+            if rows else np.empty((0, *THUMBNAIL_SHAPE), dtype=np.uint8)
+
+    def get(self, file: MediaFile) -> MediaInfo:
+        """ Return info of file, computing it (and storing it in the cache) only if file is new or changed. """
+        stat = os.stat(file.path)
+        path = os.path.abspath(file.path)
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(self.columns)} FROM media WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            info = MediaInfo(*row)
+            if info.histogram is not None:
+                info.histogram = np.frombuffer(info.histogram, dtype=np.float32)
+            if info.size == stat.st_size and info.mtime == stat.st_mtime_ns:
+                if info.thumbnail is not None and info.thumbnail >= len(self.thumbnails):
+                    self._map_thumbnails()  # Thumbnail was stored by another process
+                return info
+
+        # Decode file, only this once
+        info = MediaInfo(path, stat.st_size, stat.st_mtime_ns, 0, 0, file.creation_date)
+        if isinstance(file, ImageFile):
+            thumbnail = self._compute_image(info)
+            self._put(info, thumbnail)
+        elif isinstance(file, VideoFile):
+            self._compute_video(info)
+            self._put(info)
+        return info
+
+    def get_scores(self, files: list[MediaFile]) -> dict[str, Scores]:
+        """ Return scores of files that were scored and are unchanged since, by path. """
+        scores = {}
+        for file in files:
+            stat = os.stat(file.path)
+            with self.lock:
+                row = self.db.execute("SELECT size, mtime, sharpness, exposure, faces FROM scores WHERE path = ?",
+                                      (os.path.abspath(file.path),)).fetchone()
+            if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+                scores[file.path] = Scores(*row[2:])
+        return scores
+
+    def put_scores(self, files: list[MediaFile], scores: list[Scores]):
+        """ Store scores of files, in one transaction. """
+        rows = []
+        for file, file_scores in zip(files, scores):
+            stat = os.stat(file.path)
+            rows.append((os.path.abspath(file.path), stat.st_size, stat.st_mtime_ns,
+                         file_scores.sharpness, file_scores.exposure, file_scores.faces))
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def thumbnail(self, info: MediaInfo) -> Image:
+        """ Return thumbnail of image. """
+        return Image(np.array(self.thumbnails[info.thumbnail]))
+
+    def preview(self, info: MediaInfo) -> Image:
+        """ Return thumbnail of image, resized back to the image's aspect ratio (for previews). """
+        thumbnail = self.thumbnail(info)
+        if info.width > info.height:
+            return thumbnail.resize(target_height=THUMBNAIL_SIZE * info.height // info.width)
+        return thumbnail.resize(target_width=THUMBNAIL_SIZE * info.width // info.height)
+
+    @staticmethod
+    def _compute_image(info: MediaInfo) -> Image:
+        """ Fill in info of image from one full decode; return its thumbnail. """
+        img = Image(cv2.imread(info.path))
+        info.width, info.height = img.width, img.height
+        info.sharpness = img.get_var_of_laplacian()
+        thumbnail = Image(cv2.resize(img, (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA))
+        info.histogram = cv2.calcHist([thumbnail], [0], None, [256], [0, 256]).ravel()
+        return thumbnail
+
+    @staticmethod
+    def _compute_video(info: MediaInfo):
+        """ Fill in info of video from a probe of its container, without decoding it. """
+        data = probe(info.path)
+        video = next(stream for stream in data["streams"] if stream["codec_type"] == "video")
+        audio = next((stream for stream in data["streams"] if stream["codec_type"] == "audio"), None)
+        duration = float(video.get("duration", data["format"]["duration"])) * 1000
+
+        info.width, info.height = video["width"], video["height"]
+        info.fps = frame_rate(video.get("avg_frame_rate", "0/0")) or frame_rate(video.get("r_frame_rate", "0/0"))
+        info.duration = duration
+        if audio is not None:
+            info.audio_duration = float(audio["duration"]) * 1000 if "duration" in audio else duration
+
+    def _put(self, info: MediaInfo, thumbnail: Image = None):
+        """
+        Store info (and thumbnail). The thumbnail's row is allocated in the same write transaction that stores the
+        info, so two processes (or threads) never write to the same row: a file that already has a row (outdated,
+        or just stored by another thread) keeps it, and a new file takes the next free row.
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")  # Lock database for writing, across processes
+            try:
+                if thumbnail is not None:
+                    row = self.db.execute("SELECT thumbnail FROM media WHERE path = ?", (info.path,)).fetchone()
+                    if row is not None and row[0] is not None:
+                        row = row[0]
+                    else:
+                        row = self.db.execute("SELECT value FROM counters WHERE name = 'thumbnails'").fetchone()[0]
+                        self.db.execute("UPDATE counters SET value = ? WHERE name = 'thumbnails'", (row + 1,))
+                    with open(self.thumbnails_path, "r+b") as f:
+                        f.seek(row * THUMBNAIL_BYTES)
+                        f.write(np.ascontiguousarray(thumbnail).tobytes())
+                    info.thumbnail = row
+
+                values = [getattr(info, column) for column in self.columns]
+                if info.histogram is not None:
+                    values[self.columns.index("histogram")] = info.histogram.astype(np.float32).tobytes()
+                self.db.execute(
+                    f"INSERT OR REPLACE INTO media ({', '.join(self.columns)}) VALUES ({', '.join('?' * len(values))})",
+                    values)
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+            if info.thumbnail is not None and info.thumbnail >= len(self.thumbnails):
+                self._map_thumbnails()
+
+    def close(self):
+        self.db.close()
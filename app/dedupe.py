@@ -0,0 +1,103 @@
+
+import numpy as np
+
+
+HASH_SIZE = 8  # Hashes are HASH_SIZE x HASH_SIZE bits
+DCT_SIZE = 32  # Size images are reduced to before taking DCT
+
+
+def area_matrix(size_in: int, size_out: int) -> np.ndarray:
+    """ Return matrix that resizes a vector of size_in to size_out by averaging over areas (like cv2.INTER_AREA). """
+    edges = np.linspace(0, size_in, size_out + 1)
+    pixels = np.arange(size_in)
+    overlap = np.clip(np.minimum(edges[1:, None], pixels + 1) - np.maximum(edges[:-1, None], pixels), 0, None)
+    return overlap / overlap.sum(axis=1, keepdims=True)
+
+
+def dct_matrix(size: int) -> np.ndarray:
+    """ Return orthonormal DCT-II matrix. """
+    k, n = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def perceptual_hashes(thumbnails: np.ndarray, rows: np.ndarray = None, batch_size: int = 1024) -> np.ndarray:
+    """
+    Compute perceptual hashes (pHash) of images in batches, with matrix products instead of per-image calls.
+    :param thumbnails: array of thumbnails, shape (N, height, width, 3), BGR (e.g. memory-mapped from cache)
+    :param rows: rows of thumbnails to hash, or None to hash all of them
+    :param batch_size: number of thumbnails to read into memory at once
+    :return: array of 64-bit hashes
+    """
+    rows = np.arange(len(thumbnails)) if rows is None else np.asarray(rows)
+    height, width = thumbnails.shape[1:3]
+    resize_y, resize_x = area_matrix(height, DCT_SIZE), area_matrix(width, DCT_SIZE)
+    dct = dct_matrix(DCT_SIZE)[:HASH_SIZE]
+    # Resize and DCT in one product on each side
+    left, right = (dct @ resize_y).astype(np.float32), (dct @ resize_x).T.astype(np.float32)
+    gray_weights = np.array([0.114, 0.587, 0.299], dtype=np.float32)  # BGR
+
+    hashes = np.empty(len(rows), dtype=np.uint64)
+    for i in range(0, len(rows), batch_size):
+        batch = np.asarray(thumbnails[rows[i: i + batch_size]], dtype=np.float32)
+        gray = batch @ gray_weights
+        low = (left @ gray @ right).reshape(len(batch), -1)
+
+        # Bits are whether each low frequency is above the median (ignoring DC term)
+        bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+        hashes[i: i + len(batch)] = np.packbits(bits, axis=1).view(">u8").ravel()
+    return hashes
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """ Return number of set bits of each element of uint64 array. """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[x[..., None].view(np.uint8)].sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ Return matrix of Hamming distances between hashes a and hashes b. """
+    return popcount(a[:, None] ^ b[None, :])
+
+
+def cluster_duplicates(hashes: np.ndarray, max_distance: int, block_size: int = 256) -> np.ndarray:
+    """
+    Cluster near-duplicate images across the whole set, in order: each image joins the cluster of the first earlier
+    representative within max_distance of it, or else starts a new cluster as its representative. Every image is
+    then within max_distance of the image that is kept for it, so a run of gradually changing shots (e.g. a burst,
+    or a slow pan) does not chain into one cluster.
+    Images are compared against all representatives so far, a block of images at a time.
+    :param hashes: perceptual hashes of images
+    :param max_distance: max Hamming distance between hashes of near-duplicates
+    :param block_size: number of images to compare at once
+    :return: for each image, index of first image (representative) of its cluster
+
+    A chain A ~ B ~ C, where A and C are too far apart, is two clusters:
+    >>> cluster_duplicates(np.array([0b000000, 0b000111, 0b111111], dtype=np.uint64), 3).tolist()
+    [0, 0, 2]
+    """
+    clusters = np.empty(len(hashes), dtype=np.int64)
+    representatives = np.empty(0, dtype=np.int64)  # Indices of representatives, in order
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start: start + block_size]
+
+        # Images near a representative from an earlier block join the first one
+        near = hamming_distances(block, hashes[representatives]) <= max_distance
+        matched = near.any(axis=1)
+        if matched.any():
+            clusters[start: start + len(block)][matched] = representatives[near[matched].argmax(axis=1)]
+
+        # Other images are compared with each other, in order, to find the block's new representatives
+        unmatched = np.flatnonzero(~matched)
+        near = hamming_distances(block[unmatched], block[unmatched]) <= max_distance
+        new = np.zeros(len(unmatched), dtype=bool)  # Whether each of them is a new representative
+        for k in range(len(unmatched)):
+            first = np.flatnonzero(near[k, :k] & new[:k])
+            first = first[0] if len(first) else k
+            new[k] = first == k
+            clusters[start + unmatched[k]] = start + unmatched[first]
+        representatives = np.concatenate([representatives, start + unmatched[new]])
+    return clusters
@@ -4,6 +4,8 @@ import numpy as np
 from pydub import AudioSegment
 import os
 import random
+import subprocess
+import itertools
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
@@ -11,9 +13,15 @@ from config import *
 from app.util import *
 
 class Image(np.ndarray):
-    """ Wrapper class for images. """
+    """
+    Wrapper class for images.
+    Operations that produce a new image take an optional dst, a preallocated image (of the result's size) to write
+    the result to instead of allocating a new one; crops are otherwise views of the image.
+    """
 
     def __new__(cls, mat: np.ndarray):
+        if isinstance(mat, cls):
+            return mat  # Already wrapped (e.g. a dst image)
         return mat.view(cls)
 
     @property
@@ -22,11 +30,12 @@ class Image(np.ndarray):
     @property
     def height(self) -> int: return self.shape[0]
 
-    def resize(self, target_width: int = None, target_height: int = None) -> 'Image':
+    def resize(self, target_width: int = None, target_height: int = None, dst: np.ndarray = None) -> 'Image':
         """
         Resize image to specified width or height, keeping aspect ratio.
         :param target_width: width to resize to, or None to keep proportional to height
         :param target_height: height to resize to, or None to keep proportional to width
+        :param dst: image to write result to, or None to allocate one
         :return: resized image
         """
         if target_height is None:
@@ -36,41 +45,49 @@ class Image(np.ndarray):
             # Width not specified; keep proportional to height
             target_width = int((target_height / self.height) * self.width)
 
-        return Image(cv2.resize(self, (target_width, target_height)))
+        return Image(cv2.resize(self, (target_width, target_height), dst=dst))
     
-    def resize_to_contain(self, target_width: int, target_height: int) -> 'Image':
-        """ Resize image such that target width and height are contained fittingly within the image. """
+    def contain_size(self, target_width: int, target_height: int) -> tuple[int, int]:
+        """ Return size that image would have after resize_to_contain. """
         ratio = self.width / self.height
         target_ratio = target_width / target_height
-        
+
         if ratio > target_ratio:
             # Image is wider than target; resize to target height
-            return self.resize(target_height=target_height)
+            return int((target_height / self.height) * self.width), target_height
         elif ratio < target_ratio:
             # Image is taller than target; resize to target width
-            return self.resize(target_width=target_width)
+            return target_width, int((target_width / self.width) * self.height)
         else:
             # Image is same ratio as target; resize to target
-            return self.resize(target_width=target_width, target_height=target_height)
+            return target_width, target_height
 
-    def crop(self, x, y, width, height) -> 'Image':
-        return Image(self[y: y+height, x: x+width])
+    def resize_to_contain(self, target_width: int, target_height: int, interpolation=cv2.INTER_LINEAR,
+                          dst: np.ndarray = None) -> 'Image':
+        """ Resize image such that target width and height are contained fittingly within the image. """
+        return Image(cv2.resize(self, self.contain_size(target_width, target_height), dst=dst,
+                                interpolation=interpolation))
+
+    def crop(self, x, y, width, height, dst: np.ndarray = None) -> 'Image':
+        """ Return view of region of image, or copy it to dst (e.g. to write it out contiguously). """
+        view = self[y: y+height, x: x+width]
+        if dst is None:
+            return Image(view)
+        np.copyto(dst, view)
+        return Image(dst)
     
-    def crop_middle(self, width, height) -> 'Image':
-        return self.crop(int(self.width/2 - width/2), int(self.height/2 - height/2), width, height)
+    def crop_middle(self, width, height, dst: np.ndarray = None) -> 'Image':
+        return self.crop(int(self.width/2 - width/2), int(self.height/2 - height/2), width, height, dst=dst)
 
-    def pan(self, percent_x, percent_y, target_width, target_height) -> 'Image':
+    def pan(self, percent_x, percent_y, target_width, target_height, dst: np.ndarray = None) -> 'Image':
         startx = int(percent_x * (self.width - target_width))
         starty = int(percent_y * (self.height - target_height))
-        return self.crop(startx, starty, target_width, target_height)
-
-    def zoom(self, scale) -> 'Image':
-        # Increase size of image
-        bigger = self.resize(int(self.width / scale), int(self.height / scale))
+        return self.crop(startx, starty, target_width, target_height, dst=dst)
 
-        # Crop to original size (centered)
-        return bigger.crop(
-            int(bigger.width/2 - self.width/2), int(bigger.height/2 - self.height/2), self.width, self.height)
+    def zoom(self, scale, dst: np.ndarray = None) -> 'Image':
+        # Resize centered region (a view) up to original size, instead of resizing whole image and cropping it
+        region = self.crop_middle(int(self.width * scale), int(self.height * scale))
+        return region.resize(self.width, self.height, dst=dst)
         
     def rotate(self, angle) -> 'Image':
         M = cv2.getRotationMatrix2D((self.width/2, self.height/2), angle, 1)
@@ -125,6 +142,7 @@ class MediaFile(ABC):
 
     path: str
     _loaded: bool = False
+    date: float = None  # Creation date, once computed
 
     @abstractmethod
     def load(self):
@@ -132,6 +150,10 @@ class MediaFile(ABC):
         if self._loaded: return
         self._loaded = True
 
+    def unload(self):
+        """ Release file data. """
+        self._loaded = False
+
     @abstractmethod
     def __next__(self) -> Image:
         """ For streaming; return next frame. """
@@ -143,9 +165,11 @@ class MediaFile(ABC):
         return os.path.splitext(os.path.basename(self.path))[0]
 
     @property
-    def creation_date(self) -> int:
-        """ Return creation date of image. """
-        return creation_date(self.path)
+    def creation_date(self) -> float:
+        """ Return creation date of file (only computed once). """
+        if self.date is None:
+            self.date = creation_date(self.path)
+        return self.date
 
 
 @dataclass
@@ -156,9 +180,22 @@ class ImageFile(MediaFile):
 
     def load(self):
         """ Load image from file. """
+        if self._loaded: return
         super().load()
         self.img = Image(cv2.imread(self.path))
-    
+
+    def unload(self):
+        """ Release image. """
+        super().unload()
+        self.img = None
+
+    @property
+    def creation_date(self) -> float:
+        """ Return date photo was taken (from EXIF), or creation date of file if unknown (only computed once). """
+        if self.date is None:
+            self.date = exif_date(self.path) or creation_date(self.path)
+        return self.date
+
     def __next__(self) -> Image:
         """ Return image. """
         assert self._loaded, "Image not loaded"
@@ -170,16 +207,43 @@ class VideoFile(MediaFile):
     """ Class for video files. """
 
     capture: cv2.VideoCapture = None
-    audio: AudioSegment = None
 
     def load(self):
-        """ Load video and audio from file. """
+        """ Load video from file. """
+        if self._loaded: return
         super().load()
         self.capture = cv2.VideoCapture(self.path)
+
+    def unload(self):
+        """ Release video capture. """
+        super().unload()
+        if self.capture is not None:
+            self.capture.release()
+        self.capture = None
+
+    def load_audio(self, start: float = 0, duration: float = None, frame_rate: int = 44100,
+                   channels: int = 2) -> AudioSegment:
+        """
+        Decode only a window of the audio of the video.
+        :param start: start of window in ms
+        :param duration: duration of window in ms, or None for rest of audio
+        :param frame_rate: sample rate to decode to
+        :param channels: number of channels to decode to
+        :return: audio, or None if video has no audio
+        """
+        # Seek before input, so ffmpeg skips straight to the window instead of decoding up to it
+        cmd = ["ffmpeg", "-v", "error", "-ss", f"{start / 1000}", "-i", self.path]
+        if duration is not None:
+            cmd += ["-t", f"{duration / 1000}"]
+        cmd += ["-vn", "-f", "s16le", "-ar", f"{frame_rate}", "-ac", f"{channels}", "-"]
         try:
-            self.audio = AudioSegment.from_file(self.path)
-        except Exception as e:  # TODO: Handle this better
-            print(f"Error loading audio from video {self.path}:", e)
+            data = subprocess.run(cmd, capture_output=True, check=True).stdout
+        except subprocess.CalledProcessError as e:  # TODO: Handle this better
+            print(f"Error loading audio from video {self.path}:", e.stderr.decode(errors="ignore"))
+            return None
+        if not data:
+            return None
+        return AudioSegment(data=data, sample_width=2, frame_rate=frame_rate, channels=channels)
 
     def __next__(self) -> Image:
         """ Return next frame of video. """
@@ -189,6 +253,32 @@ class VideoFile(MediaFile):
             raise StopIteration
         return Image(frame)
 
+    def resample(self, fps: float):
+        """
+        Yield frames at given frame rate, from current position of video.
+        Source frames between output frames are skipped with grab(), so they are never converted; if the video's
+        frame rate is lower, frames are repeated instead.
+        """
+        # Source frame nearest each output frame is the first one at most half a source frame before it
+        tolerance = 1000 / (self.fps or fps) / 2
+        origin = None  # Timestamp of first frame
+        ts = -np.inf  # Timestamp of last grabbed frame, relative to first frame
+        frame, fresh = None, False
+        for k in itertools.count():
+            target = k * 1000 / fps
+            while ts < target - tolerance:
+                if not self.capture.grab():
+                    return
+                pos = self.capture.get(cv2.CAP_PROP_POS_MSEC)
+                origin = pos if origin is None else origin
+                ts, fresh = pos - origin, True
+            if fresh:
+                success, frame = self.capture.retrieve()
+                if not success:
+                    return
+                frame, fresh = Image(frame), False
+            yield frame
+
     @property
     def width(self) -> int:
         return self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)
@@ -205,6 +295,7 @@ class VideoFile(MediaFile):
         self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
     
     def set_time(self, time):
+        """ Seek to time in ms (OpenCV seeks to the keyframe before it, and decodes forward without converting). """
         self.capture.set(cv2.CAP_PROP_POS_MSEC, time)
     
     def set_percent(self, percent):
@@ -221,14 +312,18 @@ class VideoFile(MediaFile):
         return self.get_duration_seconds() * 1000
 
 
+IMAGE_EXTENSIONS = {".jpg", ".jpeg"}
+VIDEO_EXTENSIONS = {".mp4", ".mov"}
+AUDIO_EXTENSIONS = {".mp3", ".wav"}
+
 def is_image(path: str) -> bool:
     """ Return True if path is image file. """
-    return os.path.isfile(path) and os.path.splitext(path)[1] in {".jpg", ".jpeg"}
+    return os.path.isfile(path) and os.path.splitext(path)[1] in IMAGE_EXTENSIONS
 
 def is_video(path: str) -> bool:
     """ Return True if path is video file. """
-    return os.path.isfile(path) and os.path.splitext(path)[1] in {".mp4", ".mov"}
+    return os.path.isfile(path) and os.path.splitext(path)[1] in VIDEO_EXTENSIONS
 
 def is_audio(path: str) -> bool:
     """ Return True if path is audio file. """
-    return os.path.isfile(path) and os.path.splitext(path)[1] in {".mp3", ".wav"}
+    return os.path.isfile(path) and os.path.splitext(path)[1] in AUDIO_EXTENSIONS
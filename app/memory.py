@@ -0,0 +1,42 @@
+
+import threading
+import weakref
+
+from config import *
+
+
+class MemoryBudget:
+    """
+    Bytes of decoded images alive in memory, bounded by a budget.
+    Bytes are reserved before an image is decoded (see Prefetcher), and only released once the image, or the
+    downscaled copy of it that is kept for rendering, is freed. So the budget bounds how much decoded image data is
+    alive at once: images are only decoded ahead while they fit in it.
+    """
+
+    def __init__(self, budget: int = MEMORY_BUDGET):
+        self.budget = budget
+        self.nbytes = 0  # Bytes reserved
+        self.peak = 0  # Most bytes reserved at once
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes: int, force: bool = False) -> bool:
+        """
+        Reserve bytes, if they fit in budget.
+        :param force: reserve bytes even if over budget (e.g. for the image that is needed next)
+        :return: whether bytes were reserved
+        """
+        with self.lock:
+            if not force and self.nbytes + nbytes > self.budget:
+                return False
+            self.nbytes += nbytes
+            self.peak = max(self.peak, self.nbytes)
+            return True
+
+    def release(self, nbytes: int):
+        """ Release reserved bytes. """
+        with self.lock:
+            self.nbytes -= nbytes
+
+    def hold(self, img, nbytes: int):
+        """ Keep bytes reserved until img (and every view of it) is freed. """
+        weakref.finalize(img, self.release, nbytes)
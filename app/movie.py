@@ -4,14 +4,32 @@ import numpy as np
 from pydub import AudioSegment
 import os
 import random
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import pickle
 from tqdm import tqdm
+import math
+import itertools
+import functools
 from itertools import groupby
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 from config import *
 from app.util import *
 from app.media import *
+from app.beats import *
+from app.schedule import *
+from app.timeline import *
+from app.render import *
+from app.transitions import *
+from app.plan import *
+from app.output import *
+from app.cache import *
+from app.score import *
+from app.dedupe import *
+from app.memory import *
+from app.prefetch import *
+from app.profiling import *
 
 
 def cluster_files_by_date(files: list[MediaFile], margin: int = 20):
@@ -34,20 +52,24 @@ def cluster_files_by_date(files: list[MediaFile], margin: int = 20):
     return clusters
 
 
-def choose_representatives(cluster: list[MediaFile]) -> list[MediaFile]:
-    """ Choose representative files for cluster. """
-    # Return all videos and first image
-    image_found = False
+def choose_representatives(cluster: list[MediaFile], scores: dict[str, float] = None) -> list[MediaFile]:
+    """
+    Choose representative files for cluster.
+    :param scores: score of images by path (higher is better), to choose the best image instead of the first
+    """
+    # Return all videos and first (or best scoring) image, in order
+    images = [file for file in cluster if isinstance(file, ImageFile)]
+    best = None
+    if images:
+        best = max(images, key=lambda file: scores.get(file.path, -np.inf)) if scores else images[0]
     for file in cluster:
-        if isinstance(file, VideoFile):
+        if isinstance(file, VideoFile) or file is best:
             yield file
-        elif not image_found and isinstance(file, ImageFile):
-            yield file
-            image_found = True
 
 
-def choose_representatives_by_laplacian(cluster: list[MediaFile]) -> list[MediaFile]:
+def choose_representatives_by_laplacian(cluster: list[MediaFile], cache: MediaCache = None) -> list[MediaFile]:
     """ Choose representative files for cluster. """
+    cache = cache or MediaCache()
     best_laplacian = None
     best: ImageFile = None
     for file in cluster:
@@ -55,9 +77,8 @@ def choose_representatives_by_laplacian(cluster: list[MediaFile]) -> list[MediaF
             # Keep all videos
             yield file
         elif isinstance(file, ImageFile):
-            # Load image to get laplacian
-            file.load()
-            laplacian = file.img.get_var_of_laplacian()
+            # Get laplacian of image (only decoded if not cached)
+            laplacian = cache.get(file).sharpness
 
             # Choose image with highest laplacian
             if best_laplacian is None or laplacian > best_laplacian:
@@ -67,6 +88,35 @@ def choose_representatives_by_laplacian(cluster: list[MediaFile]) -> list[MediaF
         yield best
 
 
+def order_files(files: list[MediaFile], by_date: bool = False, scorer: Scorer = None, cache: MediaCache = None,
+                workers: int = os.cpu_count(), executor: ThreadPoolExecutor = None) -> list[MediaFile]:
+    """
+    Order files for movie, either by date (keeping representatives of each cluster) or by name.
+    :param scorer: how to score images, to keep the best image of each cluster instead of the first, or None
+    :param cache: cache of image scores, or None to use the default one
+    :param workers: number of threads to score images on
+    :param executor: pool of threads to score images on, shared with other work, instead of starting new threads
+    """
+    if by_date:
+        # Sort and cluster files by date
+        clusters = cluster_files_by_date(files)
+        print(f"      # of clusters: {len(clusters)}")
+
+        # Score images of all clusters with more than one image in one pass (scores are cached)
+        scores = None
+        if scorer is not None:
+            candidates = [[file for file in cluster if isinstance(file, ImageFile)] for cluster in clusters]
+            candidates = [file for images in candidates if len(images) > 1 for file in images]
+            scores = {path: scorer(file_scores)
+                      for path, file_scores in score_images(candidates, cache, workers, executor=executor).items()}
+
+        # Choose representative files from each cluster
+        return [file for cluster in clusters for file in choose_representatives(cluster, scores)]
+    else:
+        # Sort files by name (assumes files are named sequentially)
+        return sorted(files, key=lambda file: int(file.name))
+
+
 @dataclass
 class Movie:
     files: list[MediaFile]
@@ -74,6 +124,12 @@ class Movie:
     width: int = 640
     height: int = 480
     fps: int = 30
+    beats: list[Beats] = None  # Beats of musics, or None to detect them on export
+    cache: MediaCache = None  # Cache of media metadata and thumbnails, or None to use the default one
+    # Max bytes of decoded images in memory while rendering (or a budget shared with other movies)
+    memory_budget: int | MemoryBudget = MEMORY_BUDGET
+    profiler: Profiler = field(default_factory=Profiler)  # Timers and counters of pipeline stages
+    segment_dir: str = SEGMENTDIR  # Directory of encoded segments of slides, for incremental renders
 
     # Slide duration parameters
     min_duration_similar: int = 100  # Minimum duration of similar image slides in ms
@@ -83,30 +139,67 @@ class Movie:
     min_duration_video: int = 2000  # Minimum duration of video in ms
     min_duration_last: int = 4000  # Minimum duration of last slide in ms
 
+    # Beat alignment parameters (beat strengths are from 0 to 1)
+    duration_cost: float = 0.1  # Cost per second a slide lasts beyond its minimum duration, to end on a later beat
+    offbeat_cost: float = 1  # Cost of a slide not ending on a beat (it then lasts its maximum duration)
+    keep_bonus: float = 3  # Score of a slide keeping its duration from the previous plan (so it can be reused)
+
+    # Transition parameters
+    transition: str = "cut"  # Transition between slides: "cut", or name of transition (see TRANSITIONS)
+    transition_duration: int = 300  # Duration of transitions in ms
+
     # Pan and zoom parameters
     zoom_pct: float = 0.08  # Zoom percentage
     prepan_scale: float = 1.1  # Scale before panning
 
+    # Preview parameters
+    preview_scale: float = 0.25  # Resolution of preview, relative to movie
+    preview_fps: int = 10  # Max FPS of preview
+
+    # Video parameters
+    video_offset_pct: float = 0  # Where to start videos longer than their slide (0 = start, 0.5 = middle section)
+
     # Remove duplicates parameters
-    remove_similarity: float = 0.5  # Similarity threshold for removing duplicates
-    similar_threshold: float = 0.3  # Similarity threshold for similar slides
+    remove_distance: int = 6  # Max distance between perceptual hashes (out of 64 bits) for removing duplicates
+    similar_distance: int = 16  # Max distance between perceptual hashes for similar slides
 
-    def export(self, path: str):
-        """ Export movie to file. """
+    def plan(self, previous: Plan = None) -> Plan:
+        """
+        Plan slides of movie: timing to the music, pan/zoom, and removal of duplicate images.
+        :param previous: plan of a previous render, whose slide durations are kept where they still fit (so that
+            adding or removing a file only changes the slides around it)
+        """
         ms_per_frame = 1/self.fps * 1000
-        
-        # Create video writer
-        videowriter = cv2.VideoWriter(f"{path}.avi", cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (self.width, self.height))
-        
-        # Set audio output
-        music: AudioSegment = self.musics[music_idx := 0]
-        loudness_threshold = music.dBFS
+        plan = Plan(self.width, self.height, self.fps)
+        cache = self.cache or MediaCache()
+        profiler = self.profiler
+
+        # Detect beats of music once, up front (unless given, then whoever analyzed them timed it)
+        beats = self.beats
+        if beats is None:
+            with profiler.stage("analyze music", len(self.musics), "tracks"):
+                beats = [Beats.from_audio(m) for m in self.musics]
 
-        # Iterate through slides
-        t = 0  # Time in ms
-        even = False
-        for i, file in tqdm(enumerate(self.files), desc="Exporting", unit="slides", total=len(self.files)):
-            file.load()  # Make sure file data is loaded
+        # Metadata and thumbnails of files (only decoded if not cached)
+        infos = []
+        for file in tqdm(self.files, desc="Scanning", unit="files"):
+            with profiler.stage(f"scan {'image' if isinstance(file, ImageFile) else 'video'}", unit="files"):
+                infos.append(cache.get(file))
+
+        # Find near-duplicate images across the whole movie in one batch; all but the first of each are removed
+        images = [i for i, file in enumerate(self.files) if isinstance(file, ImageFile)]
+        with profiler.stage("find duplicates", len(images), "images"):
+            hashes = np.zeros(len(self.files), dtype=np.uint64)
+            hashes[images] = perceptual_hashes(cache.thumbnails, [infos[i].thumbnail for i in images])
+            clusters = cluster_duplicates(hashes[images], self.remove_distance)
+            duplicates = {images[i] for i, first in enumerate(clusters) if first != i}
+
+        # Iterate through slides, finding range of durations of each
+        last = None  # Index of previous slide's file, if image
+        min_durations, max_durations = [], []
+        for i, file in tqdm(enumerate(self.files), desc="Planning", unit="slides", total=len(self.files)):
+            slide = Slide(file.path, "image" if isinstance(file, ImageFile) else "video", 0, 0, 0)
+            info = infos[i]
 
             if isinstance(file, ImageFile):
                 # Initialize minimum and max duration of image slide
@@ -114,116 +207,341 @@ class Movie:
                 max_duration = self.max_duration_img
                 
                 # We pan image in a certain direction if shape is different from movie shape
-                ratio = file.img.width / file.img.height
+                ratio = info.width / info.height
                 target_ratio = self.width / self.height
-                pan_x = ratio > target_ratio
-                pan_y = ratio < target_ratio
-                if pan_x or pan_y:
+                slide.pan_x = ratio > target_ratio
+                slide.pan_y = ratio < target_ratio
+                if slide.pan_x or slide.pan_y:
                     min_duration = min(min_duration, self.min_duration_pan)
 
-                # For panning/zooming
-                even = not even
-                r1, r2 = random.random(), random.random()
+                # For panning/zooming (seeded by file, not by position, so a re-planned slide renders the same even
+                # if files were added or removed before it, and its segment can be reused)
+                rng = random.Random(os.path.abspath(file.path))
+                slide.r1, slide.r2 = rng.random(), rng.random()
+                slide.even = rng.random() < 0.5
 
-                # Determine similarity to previous image
-                if i > 0 and isinstance(last := self.files[i - 1], ImageFile):
-                    similarity = file.img.get_similarity(last.img)
+                # Skip if image is a duplicate of an earlier image
+                if i in duplicates:
+                    continue
 
-                    # If image is similar to previous image, use minimum duration
-                    if similarity > self.similar_threshold:
-                        min_duration = min(min_duration, self.min_duration_similar)
-
-                    # Skip if image is too similar to previous image
-                    if similarity > self.remove_similarity:
-                        continue
+                # If image is similar to previous image, use minimum duration
+                if last is not None and hamming_distances(hashes[[i]], hashes[[last]])[0, 0] <= self.similar_distance:
+                    min_duration = min(min_duration, self.min_duration_similar)
+                last = i
             
             elif isinstance(file, VideoFile):
+                last = None
+
                 # Determine minimum and max duration of video slide
                 min_duration = self.min_duration_video
-                max_duration = file.get_duration()  # Use video duration
+                max_duration = info.duration  # Use video duration
 
                 # If video has audio, use audio duration for redundancy
-                if file.audio:
-                    max_duration = min(max_duration, file.audio.duration_seconds * 1000)
-            
-            # Last slide is longer than other slides
-            if i == len(self.files) - 1:
-                min_duration = max(min_duration, self.min_duration_last)
-            
-            # Determine actual duration of slide, in ms
-            duration = min_duration
-            while duration < max_duration:
-                # If next frame is at end of music, add next music
-                if t + duration + ms_per_frame > len(music):
-                    next_music = self.musics[music_idx := (music_idx + 1) % len(self.musics)]
-                    loudness_threshold = next_music.dBFS
-                    music += next_music
-
-                # If next frame is at a spike in loudness, break
-                segment = music[t + duration: t + duration + ms_per_frame]
-                if segment.dBFS > loudness_threshold:
-                    break
-
-                duration += ms_per_frame
-            duration = min(duration, max_duration)  # Make sure duration is not too long
-            
-            # Write slide to output
-            start = t
-            while t < start + duration and (frame := next(file, None)) is not None:
-                # Pan/zoom if image
-                if isinstance(file, ImageFile):
-                    # Resize frame to contain slightly larger than movie resolution
-                    frame = frame.resize_to_contain(
-                        int(self.width * self.prepan_scale), int(self.height * self.prepan_scale))
-
-                    # Alternate going from 0 to 1 and 1 to 0
-                    pct = (t - start) / duration
-                    pct = pct if even else 1 - pct
-                    if pan_x:
-                        frame = frame.pan(pct, 0, self.width, self.height)
-                    elif pan_y:
-                        frame = frame.pan(0, pct, self.width, self.height)
-                    else:
-                        frame = frame.pan(r1 * pct, r2 * pct, self.width, self.height)
-                        frame = frame.zoom(1 - self.zoom_pct * pct)
-
-                # Crop if video
-                elif isinstance(file, VideoFile):
-                    # Resize and crop frame to movie resolution
-                    frame = frame.resize_to_contain(self.width, self.height)
-                    frame = frame.crop(0, 0, self.width, self.height)
-                
-                # Write frame to output and update time
-                videowriter.write(frame)
-                t += ms_per_frame
-            
-            # If video, release video capture and overlay audio on music
-            if isinstance(file, VideoFile):
-                file.capture.release()
-                
-                if file.audio:
-                    segment = file.audio[0: t - start]
-                    music = music.overlay(segment, position=start)
- 
-        # Release video writer
-        videowriter.release()
+                if info.audio_duration is not None:
+                    max_duration = min(max_duration, info.audio_duration)
+                slide.audio_duration = info.audio_duration or 0  # Set once slide is timed
+
+            if plan.slides:  # (first slide starts with a cut)
+                slide.transition, slide.transition_duration = self.transition, self.transition_duration
+            min_durations.append(min(min_duration, max_duration))
+            max_durations.append(max_duration)
+            plan.slides.append(slide)
+
+        # Last slide is longer than other slides
+        if plan.slides:
+            min_durations[-1] = min(max(min_durations[-1], self.min_duration_last), max_durations[-1])
+
+        # Time all slides to the beats in one pass (slides change on the first frame at or after their end)
+        with profiler.stage("schedule slides", len(plan.slides), "slides"):
+            min_frames = np.ceil(np.array(min_durations) / ms_per_frame - 1e-6).astype(np.int64)
+            max_frames = np.ceil(np.array(max_durations) / ms_per_frame - 1e-6).astype(np.int64)
+            beat_times, beat_strengths = beat_grid(beats, max_frames.sum() * ms_per_frame)
+            strengths = np.zeros(max_frames.sum() + 1)
+            frames = np.ceil(beat_times / ms_per_frame - 1e-6).astype(np.int64)
+            in_range = frames < len(strengths)
+            np.maximum.at(strengths, frames[in_range], np.maximum(beat_strengths[in_range], 1e-3))
+            strengths[0] = 0
+            # Slides of previous plan keep their duration if they still can
+            previous_frames = {slide.path: slide.frames for slide in previous.slides} if previous else {}
+            preferred = np.array([previous_frames.get(slide.path, 0) for slide in plan.slides], dtype=np.int64)
+            durations = schedule_slides(min_frames, max_frames, strengths,
+                                        self.duration_cost * ms_per_frame / 1000, self.offbeat_cost,
+                                        preferred, self.keep_bonus)
+
+        start = 0  # Start of slide in frames
+        for slide, n_frames, max_duration in zip(plan.slides, durations, max_durations):
+            slide.start = start * ms_per_frame
+            slide.frames = int(n_frames)
+            slide.duration = min(n_frames * ms_per_frame, max_duration)
+            start += n_frames
+
+            if slide.kind == "video":
+                # Start video part way in, if it is longer than slide
+                slide.offset = self.video_offset_pct * (max_duration - slide.duration)
+
+                # If video has audio, overlay it on music for duration of slide
+                if slide.audio_duration:
+                    slide.audio_duration = n_frames * ms_per_frame
+
+        plan.duration = start * ms_per_frame
+        return plan
+
+    def render(self, plan: Plan, path: str, workers: int = 1, prefetch: int = 4, preview: bool = False,
+               incremental: bool = False, executor: ThreadPoolExecutor = None):
+        """
+        Render planned movie to file.
+        :param plan: plan of movie
+        :param path: file path of output video
+        :param workers: number of threads to render frames on
+        :param prefetch: number of slides to decode ahead of the one being rendered
+        :param preview: render quick draft at reduced resolution and frame rate, from cached thumbnails
+        :param incremental: reuse encoded segments of slides that are unchanged since a previous render
+        :param executor: pool of rendering threads shared with other movies (then workers is how many of its
+            threads to keep busy)
+        """
+        width, height, fps = plan.width, plan.height, plan.fps
+        if preview:
+            width, height = int(width * self.preview_scale), int(height * self.preview_scale)
+            fps = min(fps, self.preview_fps)
+        # Encoder (yuv420p) needs even dimensions
+        width, height = width // 2 * 2, height // 2 * 2
+        ms_per_frame = 1/fps * 1000
+
+        def slide_frames(slide: Slide) -> tuple[float, int]:
+            """ Return time of first frame of slide, and number of frames, at output frame rate. """
+            if fps == plan.fps:
+                return slide.start, slide.frames
+            # Output frames that fall within slide's planned time, so slides change at exactly the same times
+            end = slide.start + slide.frames * 1000 / plan.fps
+            first, last = math.ceil(slide.start / ms_per_frame - 1e-6), math.ceil(end / ms_per_frame - 1e-6)
+            return first * ms_per_frame, last - first
         
-        # Export music
-        music[0: t].export(f"{path}.wav", format="wav")
-
-        # Merge video and audio
-        print("Merging video and audio...")
-        # cmd = ["ffmpeg", "-i", f"{path}.avi", "-i", f"{path}.wav", "-c:v", "copy", "-c:a", "aac", path]
-        cmd = ["ffmpeg", "-y", 
-               "-i", f"{path}.wav", 
-               "-r", f"{self.fps}", 
-               "-i", f"{path}.avi", 
-               "-filter:a", "aresample=async=1", 
-               "-c:a", "flac", 
-               "-c:v", "copy", path]
-        for line in shexecute(cmd):
-            print(line, end="")
-
-        # Delete temporary files
-        os.remove(f"{path}.avi")
-        os.remove(f"{path}.wav")
+        # Set audio output (music is only mixed while encoding)
+        music = Timeline()
+        music.append(self.musics[music_idx := 0])
+        while len(music) < plan.duration + ms_per_frame:
+            music.append(self.musics[music_idx := (music_idx + 1) % len(self.musics)])
+
+        # Overlay audio of videos on music, decoding only the part of each video's audio that is used, and only once
+        # mixing reaches it (previews only have music, as a guide to the timing)
+        profiler = self.profiler
+
+        def load_audio(slide: Slide) -> AudioSegment:
+            with profiler.stage("decode video audio", unit="videos"):
+                return VideoFile(slide.path).load_audio(slide.offset, slide.audio_duration, music.frame_rate,
+                                                        music.channels)
+        for slide in plan.slides:
+            if slide.kind == "video" and slide.audio_duration and not preview:
+                music.overlay(functools.partial(load_audio, slide), slide.start, duration=slide.audio_duration)
+
+        options = ["-preset", "ultrafast"] if preview else []
+        if incremental:
+            # Encode each slide as its own segment, addressed by its content, and only render missing segments
+            store = SegmentStore(self.segment_dir)
+            segments = []
+            previous = None  # Key of previous slide, without its transition
+            for slide in plan.slides:
+                t0, n_frames = slide_frames(slide)
+                settings = dict(width=width, height=height, fps=fps, frames=n_frames, phase=round(t0 - slide.start, 6),
+                                prepan_scale=self.prepan_scale, zoom_pct=self.zoom_pct, store_scale=STORE_SCALE,
+                                preview=preview, options=options)
+                # A transition also depends on the last frame of the previous slide (but not on the slide before it)
+                key = slide.key(**settings, previous=previous if slide.transition != "cut" else None)
+                previous = slide.key(**settings)
+                segments.append(store.segment(key) if n_frames else None)
+            # (manifest is saved first, so no other render deletes segments this one is about to use)
+            store.save(path, preview, plan, [segment for segment in segments if segment is not None])
+            todo = [(slide, segment) for slide, segment in zip(plan.slides, segments)
+                    if segment is not None and not os.path.isfile(segment)]
+            slides_to_render = [slide for slide, _ in todo]
+            print(f"Reusing {sum(s is not None for s in segments) - len(todo)} of {len(plan.slides)} slides")
+        else:
+            slides_to_render = plan.slides
+
+        # Decoded images are only decoded ahead while they fit in memory budget
+        budget = self.memory_budget
+        if not isinstance(budget, MemoryBudget):
+            budget = MemoryBudget(budget)
+        cache = self.cache or MediaCache()
+
+        def decoded_bytes(slide: Slide) -> int:
+            """ Return bytes of decoded image of slide (from cached size), to reserve before decoding it. """
+            if slide.kind != "image" or preview:
+                return 0
+            info = cache.get(ImageFile(slide.path))
+            return info.width * info.height * 3
+
+        def load(slide: Slide) -> ImageSlide | tuple[VideoFile, Iterator[Image]]:
+            """ Decode media of slide (on a prefetch thread), once its decoded_bytes are reserved. """
+            if slide.kind == "image" and preview:
+                img = cache.preview(cache.get(ImageFile(slide.path)))
+                return ImageSlide(img, width, height, self.prepan_scale, self.zoom_pct,
+                                  slide.pan_x, slide.pan_y, slide.r1, slide.r2)
+            elif slide.kind == "image":
+                reserved = decoded_bytes(slide)
+                try:
+                    with profiler.stage("decode image", unit="images"):
+                        file = ImageFile(slide.path)
+                        file.load()
+                        img = file.img
+                        file.unload()
+                    # Full image is only needed until it is downscaled to working resolution
+                    with profiler.stage("downscale image", unit="images"):
+                        image_slide = ImageSlide(img, width, height, self.prepan_scale, self.zoom_pct,
+                                                 slide.pan_x, slide.pan_y, slide.r1, slide.r2)
+                except BaseException:
+                    budget.release(reserved)
+                    raise
+                # Only the working image stays reserved, until it is freed
+                kept = image_slide.img.nbytes
+                budget.hold(image_slide.img, kept)
+                budget.release(reserved - kept)
+                return image_slide
+            elif slide.kind == "video":
+                # Seek to start of slide (and read first frame) ahead of time
+                with profiler.stage("open video", unit="videos"):
+                    file = VideoFile(slide.path)
+                    file.load()
+                    if slide.offset:
+                        file.set_time(slide.offset)
+                    frames = file.resample(fps)
+                    first = next(frames, None)
+                return file, itertools.chain([first], frames)
+
+        def frame_pct(slide: Slide, t: float) -> float:
+            """ Return pan/zoom position of image slide at time t, alternating going from 0 to 1 and 1 to 0. """
+            pct = (t - slide.start) / slide.duration
+            return pct if slide.even else 1 - pct
+
+        # Transitions of each kind and length, with their weights computed once
+        transitions: dict[tuple[str, int], Transition] = {}
+
+        def get_transition(slide: Slide, n_frames: int) -> Transition | None:
+            """ Return transition into slide, or None for a cut. """
+            frames = min(n_frames // 2, round(slide.transition_duration / ms_per_frame))
+            if slide.transition == "cut" or frames == 0:
+                return None
+            if (slide.transition, frames) not in transitions:
+                transitions[slide.transition, frames] = TRANSITIONS[slide.transition](frames, width, height)
+            return transitions[slide.transition, frames]
+
+        def last_frame(slide: Slide) -> Image:
+            """ Render last frame of a slide that is not rendered (i.e. reused), for the next slide's transition. """
+            budget.reserve(decoded_bytes(slide), force=True)
+            loaded = load(slide)
+            t, n_frames = slide_frames(slide)
+            if slide.kind == "image":
+                return loaded.render(frame_pct(slide, t + max(n_frames - 1, 0) * ms_per_frame))
+            file, frames = loaded
+            frame = Image(np.zeros((height, width, 3), dtype=np.uint8))
+            for next_frame in itertools.islice(frames, n_frames):
+                if next_frame is not None:
+                    frame = next_frame
+            file.unload()
+            return crop_to_fill(frame, width, height)
+
+        if incremental:
+            # Video writer (video only), that moves on to next segment after each slide's frames
+            videowriter = SegmentWriter([(segment, slide_frames(slide)[1]) for slide, segment in todo],
+                                        width, height, fps, options=options + ["-f", "mp4"])
+        else:
+            # Video writer (encoding video and audio in one pass)
+            videowriter = FFmpegWriter(path, width, height, fps, music, duration=plan.duration, options=options)
+
+        # Video writer is fed in order by a pool of rendering threads
+        videowriter = TimedWriter(videowriter, profiler)
+        # (frames are rendered into preallocated output frames, which are reused once written)
+        frame_pool = FramePool(width, height)
+        pool = RenderPool(videowriter, workers, executor=executor, recycle=frame_pool.give)
+
+        # Iterate through slides, decoding upcoming slides in the background
+        predecessors = {id(slide): previous for previous, slide in zip(plan.slides, plan.slides[1:])}
+        previous = None  # Last slide rendered, and function that renders its last frame
+        loaded_slides = iter(Prefetcher(load, slides_to_render, prefetch, budget, decoded_bytes))
+        try:
+            slides = zip(slides_to_render, loaded_slides)
+            for slide, loaded in tqdm(slides, desc="Exporting", unit="slides", total=len(slides_to_render)):
+                t, n_frames = slide_frames(slide)
+
+                # Last frame of previous slide is held under the transition into this slide
+                held = None
+                transition = get_transition(slide, n_frames)
+                if transition is not None and (predecessor := predecessors.get(id(slide))) is not None:
+                    with profiler.stage("hold transition frame", unit="transitions"):
+                        if previous is not None and previous[0] is predecessor:
+                            held = np.ascontiguousarray(previous[1]())
+                        else:
+                            held = np.ascontiguousarray(last_frame(predecessor))
+                    render_transition = profiler.wrap("render transition frame", transition.render, "frames")
+
+                if slide.kind == "image":
+                    render = profiler.wrap("render image frame", loaded.render, "frames")
+                    for i in range(n_frames):
+                        pct = frame_pct(slide, t)
+                        if held is not None and i < transition.frames:
+                            pool.submit(render_transition, i, held, frame_pool.take(), loaded.render, pct)
+                        else:
+                            pool.submit(render, pct, frame_pool.take())
+                        t += ms_per_frame
+                    previous = (slide, functools.partial(loaded.render, frame_pct(slide, t - ms_per_frame)))
+
+                elif slide.kind == "video":
+                    # Resize and crop frames to movie resolution (holding last frame if video ends early)
+                    file, frames = loaded
+                    frame = Image(np.zeros((height, width, 3), dtype=np.uint8))
+                    render = profiler.wrap("render video frame", crop_to_fill, "frames")
+                    for i in range(n_frames):
+                        with profiler.stage("decode video frame", unit="frames"):
+                            next_frame = next(frames, None)
+                        if next_frame is not None:
+                            frame = next_frame
+                        if held is not None and i < transition.frames:
+                            pool.submit(render_transition, i, held, frame_pool.take(),
+                                        crop_to_fill, frame, width, height)
+                        else:
+                            pool.submit(render, frame, width, height, frame_pool.take())
+                    file.unload()
+                    previous = (slide, functools.partial(crop_to_fill, frame, width, height))
+
+            # Finish rendering and encoding
+            pool.close()
+            videowriter.release()
+        except BaseException:
+            # Stop rendering threads and ffmpeg, without leaving an incomplete video behind
+            pool.abort()
+            videowriter.abort()
+            raise
+        finally:
+            loaded_slides.close()
+
+        if incremental:
+            # Splice segments together, without re-encoding them
+            with profiler.stage("mux segments", len(segments), "segments"):
+                concat_segments(path, [segment for segment in segments if segment is not None], music,
+                                duration=plan.duration)
+            if removed := store.remove_stale():
+                print(f"Removed {removed} stale segments")
+        print(f"Peak memory usage: {peak_memory() / 1024**2:.0f} MB "
+              f"(decoded images: {budget.peak / 1024**2:.0f} of {budget.budget / 1024**2:.0f} MB)")
+
+    def export(self, path: str, workers: int = 1, plan_path: str = None, prefetch: int = 4, preview: bool = False,
+               incremental: bool = False, executor: ThreadPoolExecutor = None):
+        """
+        Export movie to file.
+        :param path: file path of output video
+        :param workers: number of threads to render frames on
+        :param plan_path: file to reuse plan from if it exists, or to save plan to otherwise
+        :param prefetch: number of slides to decode ahead of the one being rendered
+        :param preview: render quick draft at reduced resolution and frame rate (same slide timing)
+        :param incremental: reuse encoded segments of slides that are unchanged since a previous render
+        :param executor: pool of rendering threads shared with other movies
+        """
+        if plan_path is not None and os.path.isfile(plan_path):
+            plan = Plan.load(plan_path)
+        else:
+            # Incremental renders keep the timing of the last render's slides
+            previous = SegmentStore(self.segment_dir).load(path, preview) if incremental else None
+            plan = self.plan(previous[0] if previous else None)
+            if plan_path is not None:
+                plan.save(plan_path)
+        self.render(plan, path, workers, prefetch, preview, incremental, executor)
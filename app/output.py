@@ -0,0 +1,274 @@
+
+import numpy as np
+import os
+import glob
+import json
+import hashlib
+import subprocess
+import sys
+import tempfile
+import threading
+from dataclasses import asdict
+
+from app.timeline import *
+from app.plan import *
+
+
+class AudioPipe:
+    """ Stream mixed soundtrack into a pipe for ffmpeg to read, chunk by chunk, on a background thread. """
+
+    def __init__(self, audio: Timeline, duration: float = None):
+        """
+        :param audio: soundtrack to stream
+        :param duration: duration of soundtrack to use in ms, or None to use all of it
+        """
+        self.read_fd, write_fd = os.pipe()
+        sample_format = {1: "s8", 2: "s16le", 4: "s32le"}[audio.sample_width]
+        # ffmpeg input options to read from the pipe (which ffmpeg must inherit, see pass_fds)
+        self.input = ["-f", sample_format, "-ar", f"{audio.frame_rate}", "-ac", f"{audio.channels}",
+                      "-i", f"pipe:{self.read_fd}"]
+        self.thread = threading.Thread(target=self._write, args=(write_fd, audio, duration), daemon=True)
+
+    def start(self):
+        """ Start streaming, once ffmpeg has inherited the read end of the pipe. """
+        os.close(self.read_fd)  # Only ffmpeg reads from it
+        self.thread.start()
+
+    @staticmethod
+    def _write(fd: int, audio: Timeline, duration: float):
+        with open(fd, "wb") as f:
+            try:
+                for chunk in audio.chunks(duration):
+                    f.write(chunk.tobytes())
+            except BrokenPipeError:
+                pass  # ffmpeg exited; error is raised when it is waited on
+
+    def join(self):
+        self.thread.join()
+
+
+def part_path(path: str) -> str:
+    """ Return path to encode video to until it is complete (keeping its extension, so ffmpeg knows its format). """
+    root, ext = os.path.splitext(path)
+    return f"{root}.part{ext}"
+
+
+def remove_file(path: str):
+    """ Delete file, if it exists. """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    """ ffmpeg exited with an error; the message includes what ffmpeg printed. """
+
+    def __str__(self):
+        return f"{super().__str__()}\n{self.stderr.strip()}" if self.stderr else super().__str__()
+
+
+class FFmpegWriter:
+    """
+    Encode movie in one pass by piping raw frames and audio straight into ffmpeg.
+    Frames are written to ffmpeg's stdin, and the mixed audio is streamed on a second pipe by a background thread.
+    The video is only moved to its path once fully encoded, so it is never left incomplete (see abort).
+    Has the same write/release interface as cv2.VideoWriter.
+    """
+
+    def __init__(self, path: str, width: int, height: int, fps: int, audio: Timeline = None, duration: float = None,
+                 vcodec: str = "libx264", acodec: str = "flac", options: list[str] = None):
+        """
+        :param path: file path of output video
+        :param width: width of frames
+        :param height: height of frames
+        :param fps: frame rate of video
+        :param audio: soundtrack of video, or None for video only
+        :param duration: duration of soundtrack to use in ms, or None to use all of it
+        :param vcodec: ffmpeg video codec
+        :param acodec: ffmpeg audio codec
+        :param options: extra ffmpeg output options (e.g. encoder preset, or output format)
+        """
+        self.audio = AudioPipe(audio, duration) if audio is not None else None
+        cmd = ["ffmpeg", "-y", "-loglevel", "warning",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-framerate", f"{fps}",
+               "-i", "pipe:0"]
+        if self.audio is not None:
+            cmd += self.audio.input + ["-c:a", acodec]
+        self.path, self.part = path, part_path(path)
+        cmd += ["-c:v", vcodec, "-pix_fmt", "yuv420p", *(options or []), self.part]
+        self.cmd = cmd
+        self.log = tempfile.TemporaryFile()  # ffmpeg's messages, to report if it fails
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self.log,
+                                        pass_fds=(self.audio.read_fd,) if self.audio is not None else ())
+        if self.audio is not None:
+            self.audio.start()
+
+    def write(self, frame: np.ndarray):
+        """ Write frame (BGR) to video. """
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except BrokenPipeError:
+            # ffmpeg exited early (e.g. it rejected the frame size)
+            self.abort()
+            raise FFmpegError(self.process.returncode, self.cmd, stderr=self.stderr()) from None
+
+    def release(self):
+        """ Finish encoding video, and move it to its path. """
+        self.process.stdin.close()
+        if self.audio is not None:
+            self.audio.join()
+        return_code = self.process.wait()
+        stderr = self.stderr()
+        if return_code:
+            remove_file(self.part)
+            raise FFmpegError(return_code, self.cmd, stderr=stderr)
+        sys.stderr.write(stderr)  # Warnings
+        os.replace(self.part, self.path)
+
+    def abort(self):
+        """ Stop encoding (e.g. after an error), and delete the incomplete video. """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass  # ffmpeg already exited
+        self.process.kill()
+        self.process.wait()
+        if self.audio is not None:
+            self.audio.join()  # Stops once ffmpeg closes the pipe
+        remove_file(self.part)
+
+    def stderr(self) -> str:
+        """ Return what ffmpeg printed so far. """
+        self.log.seek(0)
+        return self.log.read().decode(errors="replace")
+
+
+class SegmentWriter:
+    """
+    Encode frames into a sequence of separate video files (segments), each with a given number of frames.
+    Each segment is only moved to its path once fully encoded, so a segment file is never incomplete.
+    Has the same write/release interface as cv2.VideoWriter.
+    """
+
+    def __init__(self, segments: list[tuple[str, int]], width: int, height: int, fps: int, **kwargs):
+        """
+        :param segments: path and number of frames of each segment, in order
+        :param width: width of frames
+        :param height: height of frames
+        :param fps: frame rate of video
+        :param kwargs: options for FFmpegWriter of each segment
+        """
+        self.segments = [(path, frames) for path, frames in segments if frames > 0][::-1]
+        self.size = (width, height, fps)
+        self.kwargs = kwargs
+        self.writer: FFmpegWriter = None
+        self.path = None
+        self.remaining = 0
+
+    def write(self, frame: np.ndarray):
+        """ Write frame to current segment, starting next segment if needed. """
+        if self.writer is None:
+            self.path, self.remaining = self.segments.pop()
+            self.writer = FFmpegWriter(self.path, *self.size, **self.kwargs)
+        self.writer.write(frame)
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.writer.release()
+            self.writer = None
+
+    def release(self):
+        """ Check all segments were written. """
+        assert self.writer is None and not self.segments, "Not all segments were written"
+
+    def abort(self):
+        """ Stop encoding current segment (e.g. after an error), and delete it. """
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+
+def concat_segments(path: str, segments: list[str], audio: Timeline, duration: float = None, acodec: str = "flac"):
+    """
+    Splice encoded video segments together (without re-encoding) with ffmpeg's concat demuxer, adding audio.
+    :param path: file path of output video
+    :param segments: paths of video segments, in order
+    :param audio: soundtrack of video
+    :param duration: duration of soundtrack to use in ms, or None to use all of it
+    :param acodec: ffmpeg audio codec
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as listing:
+        for segment in segments:
+            listing.write(f"file '{os.path.abspath(segment)}'\n")
+        listing.flush()
+
+        pipe = AudioPipe(audio, duration)
+        cmd = ["ffmpeg", "-y", "-loglevel", "warning",
+               "-f", "concat", "-safe", "0", "-i", listing.name,
+               *pipe.input,
+               "-c:v", "copy", "-c:a", acodec, part_path(path)]
+        process = subprocess.Popen(cmd, pass_fds=(pipe.read_fd,))
+        pipe.start()
+        pipe.join()
+        if return_code := process.wait():
+            remove_file(part_path(path))
+            raise subprocess.CalledProcessError(return_code, cmd)
+        os.replace(part_path(path), path)
+
+
+class SegmentStore:
+    """
+    Directory of encoded segments of slides, for incremental renders.
+    Each output video has a manifest of the plan it was last rendered from and the segments it uses (previews have
+    their own). Manifests are written before rendering, so the previous plan's timing can be kept when re-planning,
+    and segments that no manifest uses (e.g. of slides since changed or removed) can be deleted.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def segment(self, key: str) -> str:
+        """ Return path of segment of slide with key. """
+        return os.path.join(self.directory, f"{key}.mp4")
+
+    def manifest(self, path: str, preview: bool = False) -> str:
+        """ Return path of manifest of output video. """
+        name = hashlib.sha1(f"{os.path.abspath(path)}{':preview' if preview else ''}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def save(self, path: str, preview: bool, plan: Plan, segments: list[str]):
+        """ Save manifest of output video: plan it is rendered from, and paths of segments it uses. """
+        manifest = self.manifest(path, preview)
+        with open(f"{manifest}.part", "w") as f:
+            json.dump({"plan": asdict(plan), "segments": [os.path.basename(segment) for segment in segments]}, f)
+        os.replace(f"{manifest}.part", manifest)
+
+    def load(self, path: str, preview: bool = False) -> tuple[Plan, list[str]] | None:
+        """ Return plan and paths of segments of last render of output video, or None if there is none. """
+        try:
+            with open(self.manifest(path, preview)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return Plan.from_dict(data["plan"]), [os.path.join(self.directory, name) for name in data["segments"]]
+
+    def remove_stale(self) -> int:
+        """ Delete segments that no manifest uses; return how many were deleted. """
+        used = set()
+        for manifest in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(manifest) as f:
+                    used.update(json.load(f)["segments"])
+            except (OSError, ValueError, KeyError):
+                continue
+        removed = 0
+        for segment in glob.glob(os.path.join(self.directory, "*.mp4")):
+            # (segments still being encoded, by this or another render, are not stale)
+            if os.path.basename(segment) not in used and not segment.endswith(".part.mp4"):
+                try:
+                    os.remove(segment)
+                    removed += 1
+                except FileNotFoundError:
+                    pass  # Removed by another process
+        return removed
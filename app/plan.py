@@ -0,0 +1,68 @@
+
+import json
+import os
+import hashlib
+from dataclasses import dataclass, field, asdict
+
+
+@dataclass
+class Slide:
+    """ Plan of one slide of the movie. """
+
+    path: str  # Path of image or video file
+    kind: str  # "image" or "video"
+    start: float  # Start time of slide in ms
+    duration: float  # Duration of slide in ms
+    frames: int  # Number of frames to write
+
+    # Transition into slide from previous slide, over the start of the slide
+    transition: str = "cut"  # "cut", or name of transition (see TRANSITIONS)
+    transition_duration: float = 0  # Duration of transition in ms (at most half the slide)
+
+    # Pan and zoom (image slides only)
+    even: bool = False  # Whether to go from 0 to 1 (True) or 1 to 0 (False)
+    pan_x: bool = False
+    pan_y: bool = False
+    r1: float = 0
+    r2: float = 0
+
+    # Video slides only
+    offset: float = 0  # Time in video to start slide at, in ms
+    audio_duration: float = 0  # Duration of audio of video to overlay on music at start of slide, in ms
+
+    def key(self, **settings) -> str:
+        """
+        Return content address of rendered slide: a hash of its plan entry, its source file and render settings.
+        Start time is left out, so a slide that only moved in the movie still has the same key.
+        :param settings: anything else the rendered frames depend on (e.g. resolution)
+        """
+        stat = os.stat(self.path)
+        entry = {k: v for k, v in asdict(self).items() if k != "start"}
+        data = {**entry, "path": os.path.abspath(self.path), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                **settings}
+        return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+@dataclass
+class Plan:
+    """ Schedule of slides of a movie, computed before rendering so it can be saved and rendered again. """
+
+    width: int
+    height: int
+    fps: int
+    duration: float = 0  # Duration of movie in ms
+    slides: list[Slide] = field(default_factory=list)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=1)
+
+    @classmethod
+    def load(cls, path: str) -> 'Plan':
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Plan':
+        data = {**data, "slides": [Slide(**slide) for slide in data["slides"]]}
+        return cls(**data)
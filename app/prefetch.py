@@ -0,0 +1,61 @@
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from app.memory import *
+
+
+class Prefetcher:
+    """
+    Read ahead: load upcoming items on a thread pool while the current one is used.
+    Iterating yields loaded items in order; at most depth items are loaded ahead of the one being used.
+    With a memory budget, an item is only loaded ahead if its cost fits in the budget; otherwise loaded items are
+    yielded first, so the consumer can free memory, and the item that is needed next is always loaded.
+    """
+
+    def __init__(self, load, items: list, depth: int = 4, budget: MemoryBudget = None, cost=None):
+        """
+        :param load: function that loads an item (e.g. decodes media of a slide)
+        :param items: items, in the order they are needed
+        :param depth: number of items to load ahead, or 0 to load each item only when it is needed
+        :param budget: memory budget to reserve the cost of each item from before loading it, or None
+        :param cost: function that returns bytes to reserve for loading an item (load must release them, e.g. with
+            MemoryBudget.hold once it knows what it keeps)
+        """
+        self.load = load
+        self.items = items
+        self.depth = depth
+        self.budget = budget
+        self.cost = cost
+
+    def reserve(self, item, force: bool) -> bool:
+        """ Reserve cost of loading item from budget; return whether it fits. """
+        return self.budget is None or self.budget.reserve(self.cost(item), force)
+
+    def __iter__(self):
+        if self.depth == 0:
+            for item in self.items:
+                self.reserve(item, force=True)
+                yield self.load(item)
+            return
+
+        executor = ThreadPoolExecutor(self.depth)
+        pending: deque[tuple[Future, object]] = deque()  # Futures of items being loaded, and the items
+        items = iter(self.items)
+        try:
+            # Start loading first items, then load one more each time one is used
+            for item in items:
+                # Until item fits in budget, yield loaded items (unless none are left, then it's needed next)
+                while not self.reserve(item, force=not pending):
+                    yield pending.popleft()[0].result()
+                pending.append((executor.submit(self.load, item), item))
+                if len(pending) > self.depth:
+                    yield pending.popleft()[0].result()
+            while pending:
+                yield pending.popleft()[0].result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Items that were never loaded release their cost
+            for future, item in pending:
+                if future.cancelled() and self.budget is not None:
+                    self.budget.release(self.cost(item))
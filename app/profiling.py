@@ -0,0 +1,122 @@
+
+import os
+import time
+import json
+import threading
+import cProfile
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+
+from app.util import *
+
+
+@dataclass
+class StageStats:
+    """ Accumulated time and count of items of one pipeline stage. """
+
+    seconds: float = 0  # Total time, summed over threads (so it can be more than the wall time of the stage)
+    count: int = 0  # Number of items (e.g. files or frames)
+    unit: str = "items"
+
+
+class Profiler:
+    """
+    Timers and counters of pipeline stages, and optionally a cProfile of the main thread.
+    Stages are timed from any thread (e.g. rendering threads), and reported together at the end.
+    """
+
+    def __init__(self, cprofile: bool = False):
+        """
+        :param cprofile: whether to also collect a cProfile (of the thread that calls start/stop)
+        """
+        self.stages: dict[str, StageStats] = {}
+        self.lock = threading.Lock()
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.start_time = time.perf_counter()
+        self.wall = 0
+
+    def add(self, name: str, seconds: float, count: int = 1, unit: str = "items"):
+        """ Add time and items to stage. """
+        with self.lock:
+            stats = self.stages.setdefault(name, StageStats(unit=unit))
+            stats.seconds += seconds
+            stats.count += count
+
+    @contextmanager
+    def stage(self, name: str, count: int = 1, unit: str = "items"):
+        """ Time block of code as (part of) stage. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count, unit)
+
+    def wrap(self, name: str, fn, unit: str = "items"):
+        """ Return fn, timing each call as one item of stage. """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start, 1, unit)
+        return timed
+
+    def start(self):
+        """ Start wall clock (and cProfile, if enabled). """
+        self.start_time = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        """ Stop wall clock (and cProfile, if enabled). """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.wall = time.perf_counter() - self.start_time
+
+    def report(self) -> dict:
+        """ Return machine-readable report of all stages. """
+        return {
+            "wall_seconds": self.wall,
+            "peak_memory": peak_memory(),
+            "stages": {name: {**asdict(stats), "per_second": stats.count / stats.seconds if stats.seconds else None}
+                       for name, stats in self.stages.items()},
+        }
+
+    def summary(self) -> str:
+        """ Return table of stages, in the order they were first timed. """
+        lines = [f"{'Stage':<24} {'Time (s)':>10} {'% wall':>7} {'Count':>8} {'Per item (ms)':>14}"]
+        for name, stats in self.stages.items():
+            pct = 100 * stats.seconds / self.wall if self.wall else 0
+            per_item = 1000 * stats.seconds / stats.count if stats.count else 0
+            lines.append(f"{name:<24} {stats.seconds:10.3f} {pct:6.1f}% {stats.count:8d} {per_item:14.3f}")
+        lines.append(f"{'Total (wall)':<24} {self.wall:10.3f}")
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        """
+        Save report as JSON to path, and cProfile stats (if enabled) next to it, with extension .prof
+        (e.g. for `python -m pstats` or snakeviz).
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{os.path.splitext(path)[0]}.prof")
+
+
+class TimedWriter:
+    """ Video writer that times writing frames (i.e. waiting on the encoder) and finishing encoding. """
+
+    def __init__(self, videowriter, profiler: Profiler):
+        self.videowriter = videowriter
+        self.profiler = profiler
+
+    def write(self, frame):
+        with self.profiler.stage("encode", unit="frames"):
+            self.videowriter.write(frame)
+
+    def release(self):
+        with self.profiler.stage("finish encoding", unit="videos"):
+            self.videowriter.release()
+
+    def abort(self):
+        self.videowriter.abort()
@@ -0,0 +1,150 @@
+
+import cv2
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from config import *
+from app.media import *
+
+
+class ImageSlide:
+    """
+    Pan/zoom render plan for an image slide.
+    The image is downscaled once to a working resolution, and each frame is then a crop of it (and a single resize to
+    movie resolution if zooming). The crop rectangle is linear in time, so it is computed up front from the
+    rectangles of the first and last frame of the slide.
+    """
+
+    def __init__(self, img: Image, width: int, height: int, prepan_scale: float, zoom_pct: float,
+                 pan_x: bool, pan_y: bool, r1: float, r2: float):
+        self.width = width
+        self.height = height
+        self.zoom = not (pan_x or pan_y)
+
+        # Size of image after resizing to contain slightly larger than movie resolution
+        prepan_width, prepan_height = int(width * prepan_scale), int(height * prepan_scale)
+        contain_width, contain_height = img.contain_size(prepan_width, prepan_height)
+
+        # Downscale image once to working resolution; zoomed slides keep extra resolution so they stay sharp
+        store_scale = STORE_SCALE if self.zoom else 1
+        store_width, store_height = int(prepan_width * store_scale), int(prepan_height * store_scale)
+        if img.contain_size(store_width, store_height)[0] < img.width or not self.zoom:
+            img = img.resize_to_contain(store_width, store_height, interpolation=cv2.INTER_AREA)
+        self.img = img
+        scale_x, scale_y = img.width / contain_width, img.height / contain_height
+
+        def rect(pct: float) -> np.ndarray:
+            """ Return crop rectangle (x, y, width, height) in working image, at pct through the slide. """
+            # Same pan and zoom as Image.pan followed by Image.zoom
+            if pan_x:
+                percent_x, percent_y, zoom = pct, 0, 1
+            elif pan_y:
+                percent_x, percent_y, zoom = 0, pct, 1
+            else:
+                percent_x, percent_y, zoom = r1 * pct, r2 * pct, 1 - zoom_pct * pct
+            startx = percent_x * (contain_width - width) + width * (1 - zoom) / 2
+            starty = percent_y * (contain_height - height) + height * (1 - zoom) / 2
+            return np.array([startx * scale_x, starty * scale_y, width * zoom * scale_x, height * zoom * scale_y])
+
+        self.start = rect(0)
+        self.delta = rect(1) - self.start
+
+    def render(self, pct: float, dst: np.ndarray = None) -> Image:
+        """
+        Return frame at pct (0 to 1) through the slide.
+        :param dst: frame to render into, or None to return a new frame (or a view of the working image, if panning)
+        """
+        x, y, width, height = self.start + pct * self.delta
+        if not self.zoom:
+            return self.img.crop(int(x), int(y), self.width, self.height, dst=dst)
+        frame = self.img.crop(int(x), int(y), int(round(width)), int(round(height)))
+        return frame.resize(self.width, self.height, dst=dst)
+
+
+def crop_to_fill(frame: Image, width: int, height: int, dst: np.ndarray = None) -> Image:
+    """
+    Resize and crop frame (e.g. of a video) to fill movie resolution, keeping its top left.
+    Only the part of the frame that is kept is resized (straight into dst, if given).
+    """
+    contain_width, contain_height = frame.contain_size(width, height)
+    crop_width = min(frame.width, round(width * frame.width / contain_width))
+    crop_height = min(frame.height, round(height * frame.height / contain_height))
+    return frame.crop(0, 0, crop_width, crop_height).resize(width, height, dst=dst)
+
+
+class FramePool:
+    """
+    Preallocated output frames, reused once written. Frames are taken by the thread submitting frames, and given back
+    by the RenderPool (on the same thread) once written, so only as many frames are allocated as are in flight.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.shape = (height, width, 3)
+        self.free: list[Image] = []
+        self.owned: set[int] = set()  # Ids of frames allocated by this pool
+
+    def take(self) -> Image:
+        """ Return a free frame (with arbitrary contents), allocating one only if none are free. """
+        if self.free:
+            return self.free.pop()
+        frame = Image(np.empty(self.shape, dtype=np.uint8))
+        self.owned.add(id(frame))
+        return frame
+
+    def give(self, frame: np.ndarray):
+        """ Give back frame once written; frames not from this pool are ignored. """
+        if id(frame) in self.owned:
+            self.free.append(frame)
+
+
+class RenderPool:
+    """
+    Render frames on a pool of threads (OpenCV releases the GIL), and write them to the video writer in order.
+    Frames are submitted in output order; at most buffer_size of them are in flight at once.
+    """
+
+    def __init__(self, videowriter: cv2.VideoWriter, workers: int = 1, buffer_size: int = None,
+                 executor: ThreadPoolExecutor = None, recycle=None):
+        """
+        :param videowriter: writer to write frames to
+        :param workers: number of threads to render on (or to keep busy, if executor is given)
+        :param buffer_size: max number of frames in flight
+        :param executor: pool of threads shared with other renders, instead of starting new threads
+        :param recycle: function called with each frame once written (e.g. to reuse its buffer)
+        """
+        self.videowriter = videowriter
+        self.recycle = recycle
+        self.owns_executor = executor is None
+        self.executor = executor or (ThreadPoolExecutor(workers) if workers > 1 else None)
+        self.buffer_size = buffer_size or 4 * workers
+        self.pending: deque[Future] = deque()
+
+    def submit(self, fn, *args):
+        """ Render frame by calling fn(*args), and write it once all previous frames are written. """
+        if self.executor is None:
+            self.write(fn(*args))
+            return
+        self.pending.append(self.executor.submit(fn, *args))
+        while len(self.pending) > self.buffer_size:
+            self.write(self.pending.popleft().result())
+
+    def write(self, frame):
+        self.videowriter.write(frame)
+        if self.recycle is not None:
+            self.recycle(frame)
+
+    def close(self):
+        """ Write remaining frames and stop workers. """
+        while self.pending:
+            self.write(self.pending.popleft().result())
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown()
+
+    def abort(self):
+        """ Stop rendering (e.g. after an error): cancel frames not yet rendered, and stop workers. """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,63 @@
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from app.media import *
+
+
+def walk(directory: str, recursive: bool = False) -> Iterator[os.DirEntry]:
+    """ Yield files in directory (and its subdirectories, if recursive), without a stat per file. """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    yield from walk(entry.path, recursive)
+            elif entry.is_file():
+                yield entry
+
+
+def scan_music(paths: list[str]) -> list[str]:
+    """ Return music files in list of music files and directories. """
+    music_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file in os.listdir(path):
+                if is_audio(fp := os.path.join(path, file)):
+                    music_paths.append(fp)
+        elif is_audio(path):
+            music_paths.append(path)
+    return music_paths
+
+
+def scan_media(directory: str, recursive: bool = False, workers: int = 16,
+               executor: ThreadPoolExecutor = None) -> list[MediaFile]:
+    """
+    Find image and video files in directory, and read their creation dates.
+    Files are classified by extension from the directory listing alone; the per-file work (stat, and reading EXIF
+    of images) runs on a pool of threads, since it is mostly waiting on the disk (or network).
+    :param directory: directory to scan
+    :param recursive: whether to scan subdirectories too
+    :param workers: number of threads to read dates on
+    :param executor: pool of threads shared with other work, instead of starting new threads
+    :return: image and video files, with their creation dates cached
+    """
+    files: list[MediaFile] = []
+    for entry in walk(directory, recursive):
+        extension = os.path.splitext(entry.name)[1]
+        if extension in IMAGE_EXTENSIONS:
+            files.append(ImageFile(entry.path))
+        elif extension in VIDEO_EXTENSIONS:
+            files.append(VideoFile(entry.path))
+        else:
+            print(f"Warning: Unknown file type: {entry.path}")
+
+    # Read (and cache) creation date of each file
+    pool = executor or ThreadPoolExecutor(workers)
+    try:
+        for _ in pool.map(lambda file: file.creation_date, files):
+            pass
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return files
@@ -0,0 +1,99 @@
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+
+
+PRUNE_MARGIN = 4  # Partial schedules scoring this much less than the best one are dropped
+
+
+def schedule_slides(min_frames: np.ndarray, max_frames: np.ndarray, strengths: np.ndarray,
+                    duration_cost: float, offbeat_cost: float, preferred: np.ndarray = None,
+                    keep_bonus: float = 0) -> np.ndarray:
+    """
+    Choose the duration of every slide in one global pass, by dynamic programming over the frames of the movie.
+    Each slide either ends on a beat, within its min and max duration, or (e.g. if there is no beat in range)
+    lasts its max duration. The schedule maximizes the total strength of the beats slides end on, minus a cost
+    for each second a slide lasts beyond its min duration, and for each slide that does not end on a beat.
+    Partial schedules that score PRUNE_MARGIN below the best one are dropped, so the pass stays fast for long
+    movies; with the duration cost, this only drops schedules that are far behind.
+    :param min_frames: min duration of each slide in frames
+    :param max_frames: max duration of each slide in frames (at least its min duration)
+    :param strengths: strength of beat (0 to 1) at each frame of the movie, 0 where there is no beat; must cover
+        the sum of max durations
+    :param duration_cost: cost per frame a slide lasts beyond its min duration
+    :param offbeat_cost: cost of a slide not ending on a beat
+    :param preferred: duration of each slide to keep if it is within its min and max duration (e.g. from a previous
+        plan, so the slide renders the same), or 0 for none; a slide that keeps it scores keep_bonus, whether or
+        not it ends on a beat
+    :param keep_bonus: score of a slide keeping its preferred duration
+    :return: duration of each slide in frames
+    """
+    if not len(min_frames):
+        return np.empty(0, dtype=np.int64)
+    on_beat = strengths > 0
+    if preferred is None:
+        preferred = np.zeros(len(min_frames), dtype=np.int64)
+    # Score of ending a slide that keeps its preferred duration on each frame
+    end_score = np.where(on_beat, strengths, -offbeat_cost) + keep_bonus
+    scores = []  # Score of best partial schedule ending at each frame, for frames from offsets[i] on
+    offsets = []
+    score, offset = np.zeros(1), 0  # Start of movie
+    for lo, hi, keep in zip(min_frames, max_frames, preferred):
+        # Score of ending slide on each frame, reachable from any kept start frame
+        # (start frame s is offset + index; end frame is new_offset + index)
+        new_offset = offset + lo
+        n = len(score) + hi - lo
+        ends = np.arange(new_offset, new_offset + n)
+
+        # Ending on a beat: best start within range, counting the cost of lasting beyond min duration
+        # (the cost is linear, so it is added to the start's score, relative to its frame)
+        relative = np.full(n, -np.inf)
+        relative[:len(score)] = score + duration_cost * np.arange(len(score))
+        best_start = maximum_filter1d(relative, hi - lo + 1, origin=(hi - lo) // 2, mode="constant",
+                                      cval=-np.inf)
+        beat_score = best_start - duration_cost * np.arange(n) + strengths[ends]
+        beat_score[~on_beat[ends]] = -np.inf
+
+        # Lasting max duration, off beat
+        hold_score = np.full(n, -np.inf)
+        hold_score[hi - lo:] = score - duration_cost * (hi - lo) - offbeat_cost
+        scores.append(np.maximum(beat_score, hold_score))
+
+        # Keeping preferred duration, on or off beat
+        if lo <= keep <= hi:
+            keep_score = np.full(n, -np.inf)
+            keep_score[keep - lo: keep - lo + len(score)] = score - duration_cost * (keep - lo)
+            scores[-1] = np.maximum(scores[-1], keep_score + end_score[ends])
+        offsets.append(new_offset)
+
+        # Keep frames within margin of the best partial schedule
+        kept = np.flatnonzero(scores[-1] >= scores[-1].max() - PRUNE_MARGIN)
+        score = scores[-1][kept[0]: kept[-1] + 1]
+        offset = new_offset + kept[0]
+        scores[-1] = scores[-1][kept[0]: kept[-1] + 1]
+        offsets[-1] = offset
+
+    # Backtrack from best end of movie, recomputing which start (and option) gave each slide its score
+    durations = np.empty(len(min_frames), dtype=np.int64)
+    end = offsets[-1] + int(np.argmax(scores[-1]))
+    for i in range(len(min_frames) - 1, -1, -1):
+        lo, hi = min_frames[i], max_frames[i]
+        previous, previous_offset = (scores[i - 1], offsets[i - 1]) if i else (np.zeros(1), 0)
+        best, start = -np.inf, None
+        if on_beat[end]:
+            starts = np.arange(max(end - hi, previous_offset), min(end - lo, previous_offset + len(previous) - 1) + 1)
+            if len(starts):
+                candidates = previous[starts - previous_offset] - duration_cost * (end - starts - lo)
+                best, start = candidates.max() + strengths[end], int(starts[np.argmax(candidates)])
+        if 0 <= end - hi - previous_offset < len(previous):
+            hold = previous[end - hi - previous_offset] - duration_cost * (hi - lo) - offbeat_cost
+            if hold > best:
+                best, start = hold, end - hi
+        keep = preferred[i]
+        if lo <= keep <= hi and 0 <= end - keep - previous_offset < len(previous):
+            kept = previous[end - keep - previous_offset] - duration_cost * (keep - lo) + end_score[end]
+            if kept > best:
+                start = end - keep
+        durations[i] = end - start
+        end = start
+    return durations
@@ -0,0 +1,113 @@
+
+import cv2
+import numpy as np
+import os
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from app.media import *
+from app.cache import *
+
+
+SCORE_SIZE = 512  # Max width and height of the images that scores are computed on
+SHARPNESS_SCALE = 1000  # Sharpness (variance of laplacian at SCORE_SIZE) of a very sharp photo
+CLIP = 8  # Pixels within this many levels of black or white are clipped
+MIN_FACE = 24  # Min size of faces to detect, in pixels at SCORE_SIZE
+MAX_FACES = 3  # Faces beyond this many don't make a photo more interesting
+
+detectors = threading.local()  # Face detector of each thread (a detector can't be shared between threads)
+
+
+def face_detector():
+    """ Return Haar cascade face detector bundled with OpenCV (of this thread), or None if OpenCV has none. """
+    if not hasattr(cv2, "CascadeClassifier"):
+        return None
+    if not hasattr(detectors, "faces"):
+        path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        detectors.faces = cv2.CascadeClassifier(path)
+    return detectors.faces
+
+
+def score_image(path: str) -> Scores:
+    """
+    Compute scores of image, from a grayscale copy of at most SCORE_SIZE: sharpness, exposure and number of faces.
+    Large JPEGs are decoded straight at reduced resolution, which is several times faster than a full decode.
+    """
+    # Decode at the most reduced resolution that is still (about) at least SCORE_SIZE
+    for flag in (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_GRAYSCALE):
+        gray = cv2.imread(path, flag)
+        if gray is None or max(gray.shape) >= SCORE_SIZE:
+            break
+    if gray is None:
+        return Scores(0, 0, 0)  # Unreadable
+    if (scale := SCORE_SIZE / max(gray.shape)) < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+
+    # Exposure is best for a mid-grey mean with no clipped pixels
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    clipped = histogram[:CLIP].sum() + histogram[-CLIP:].sum()
+    mean = histogram @ np.arange(256) / 255
+    exposure = (1 - clipped) * (1 - abs(2 * mean - 1))
+
+    faces = None
+    if (detector := face_detector()) is not None:
+        faces = len(detector.detectMultiScale(cv2.equalizeHist(gray), scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(MIN_FACE, MIN_FACE)))
+    return Scores(float(sharpness), float(exposure), faces)
+
+
+@dataclass
+class Scorer:
+    """ Combines scores of an image into one number (higher is better), with a weight for each score. """
+
+    sharpness: float = 1
+    exposure: float = 1
+    faces: float = 1
+
+    def __call__(self, scores: Scores) -> float:
+        sharpness = min(np.log1p(scores.sharpness) / np.log1p(SHARPNESS_SCALE), 1)
+        faces = min(scores.faces or 0, MAX_FACES) / MAX_FACES
+        return self.sharpness * sharpness + self.exposure * scores.exposure + self.faces * faces
+
+
+def score_images(files: list[ImageFile], cache: MediaCache = None, workers: int = os.cpu_count(),
+                 batch_size: int = 64, executor: ThreadPoolExecutor = None) -> dict[str, Scores]:
+    """
+    Score images, computing scores only for images that are new or changed since they were scored.
+    Images are scored in batches on a pool of threads (OpenCV releases the GIL), and the scores of each batch are
+    stored in the cache as soon as it is done.
+    :param files: images to score
+    :param cache: cache to store scores in, or None to use the default one
+    :param workers: number of threads to score images on
+    :param batch_size: number of images to score between writes to the cache
+    :param executor: pool of threads shared with other work, instead of starting new threads
+    :return: scores of each image, by path
+    """
+    cache = cache or MediaCache()
+    detect_faces = face_detector() is not None
+    if not detect_faces:
+        print("Warning: OpenCV has no Haar face detector; images are scored without faces")
+
+    # Scores without faces are computed again once faces can be detected
+    scores = {path: file_scores for path, file_scores in cache.get_scores(files).items()
+              if file_scores.faces is not None or not detect_faces}
+    todo = [file for file in files if file.path not in scores]
+    if not todo:
+        return scores
+    pool = executor or ThreadPoolExecutor(workers)
+    try:
+        with tqdm(total=len(todo), desc="Scoring", unit="images") as progress:
+            for i in range(0, len(todo), batch_size):
+                batch = todo[i: i + batch_size]
+                batch_scores = list(pool.map(score_image, [file.path for file in batch]))
+                cache.put_scores(batch, batch_scores)
+                scores.update((file.path, file_scores) for file, file_scores in zip(batch, batch_scores))
+                progress.update(len(batch))
+    finally:
+        if executor is None:
+            pool.shutdown()
+    return scores
@@ -0,0 +1,164 @@
+
+import numpy as np
+from pydub import AudioSegment
+import wave
+from dataclasses import dataclass
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+# Number of seconds of audio to mix at a time
+CHUNK_SECONDS = 10
+
+
+@dataclass
+class Clip:
+    """ Audio placed on the timeline, by reference. """
+
+    audio: AudioSegment | Callable[[], AudioSegment]  # Audio, or function that decodes it when it is mixed
+    position: int  # Position on timeline in samples
+    length: int  # Number of samples of audio used (at most)
+
+    @property
+    def end(self) -> int:
+        return self.position + self.length
+
+
+class Timeline:
+    """
+    Soundtrack that refers to music tracks and overlaid audio by offset instead of copying them.
+    Audio is only mixed once, chunk by chunk, when exported.
+    """
+
+    def __init__(self, decode_ahead: int = 2):
+        """
+        :param decode_ahead: number of upcoming clips that decode their audio when mixed to decode ahead of mixing,
+            on background threads (0 to decode each one only once mixing reaches it)
+        """
+        self.decode_ahead = decode_ahead
+        self.tracks: list[Clip] = []  # Music tracks, one after another
+        self.overlays: list[Clip] = []  # Audio overlaid on music (e.g. audio of videos)
+        self.frame_rate = None
+        self.channels = None
+        self.sample_width = None
+
+    def __len__(self) -> int:
+        """ Return duration of music in ms (like AudioSegment). """
+        return int(self.ms(self.tracks[-1].end)) if self.tracks else 0
+
+    def samples(self, ms: float) -> int:
+        """ Convert time in ms to number of samples. """
+        return int(ms * self.frame_rate / 1000)
+
+    def ms(self, samples: int) -> float:
+        """ Convert number of samples to time in ms. """
+        return samples * 1000 / self.frame_rate
+
+    def sync(self, audio: AudioSegment) -> AudioSegment:
+        """ Convert audio to the format of the timeline, if needed (same as pydub does when combining). """
+        if self.frame_rate is None:
+            self.frame_rate, self.channels, self.sample_width = audio.frame_rate, audio.channels, audio.sample_width
+        if audio.frame_rate != self.frame_rate:
+            audio = audio.set_frame_rate(self.frame_rate)
+        if audio.channels != self.channels:
+            audio = audio.set_channels(self.channels)
+        if audio.sample_width != self.sample_width:
+            audio = audio.set_sample_width(self.sample_width)
+        return audio
+
+    def append(self, audio: AudioSegment):
+        """ Add music track to end of timeline. """
+        audio = self.sync(audio)
+        position = self.tracks[-1].end if self.tracks else 0
+        self.tracks.append(Clip(audio, position, int(audio.frame_count())))
+
+    def overlay(self, audio: AudioSegment | Callable[[], AudioSegment], position: float, duration: float = None):
+        """
+        Overlay audio on music.
+        :param audio: audio to overlay, or function that decodes it (returning None if there is none), which is only
+            called once mixing reaches the audio, and released after it; then duration is required
+        :param position: position on timeline in ms
+        :param duration: duration of audio to use in ms, or None to use all of it
+        """
+        if callable(audio):
+            self.overlays.append(Clip(audio, self.samples(position), self.samples(duration)))
+            return
+        audio = self.sync(audio)
+        length = int(audio.frame_count())
+        if duration is not None:
+            length = min(length, self.samples(duration))
+        self.overlays.append(Clip(audio, self.samples(position), length))
+
+    def decode(self, clip: Clip, dtype: type) -> np.ndarray:
+        """ Return samples of clip, of shape (samples, channels), decoding its audio if needed. """
+        audio = clip.audio() if callable(clip.audio) else clip.audio
+        if audio is None:
+            return np.zeros((0, self.channels), dtype=dtype)
+        samples = np.frombuffer(self.sync(audio).raw_data, dtype=dtype).reshape(-1, self.channels)
+        return samples[:clip.length]
+
+    def chunks(self, duration: float = None):
+        """
+        Mix timeline and yield it chunk by chunk. Only audio of clips that overlap the current chunk, or that are
+        decoded ahead of it, is held in memory (for clips that decode their audio when mixed), so memory use does not
+        grow with the duration of the timeline.
+        :param duration: duration to mix in ms, or None to mix all music
+        :return: generator of arrays of shape (samples, channels)
+        """
+        end = self.samples(duration) if duration is not None else self.tracks[-1].end
+        dtype = {1: np.int8, 2: np.int16, 4: np.int32}[self.sample_width]
+        info = np.iinfo(dtype)
+        chunk_size = CHUNK_SECONDS * self.frame_rate
+
+        # Clips sorted by position, so each chunk only looks at the clips it overlaps
+        clips = sorted(self.tracks + self.overlays, key=lambda clip: clip.position)
+        active: list[tuple[Clip, np.ndarray]] = []  # Clips that overlap chunk, and their samples
+        next_clip = 0
+
+        # Clips that decode their audio are decoded a few clips ahead, so mixing (and whoever reads the mix, e.g. an
+        # encoder) doesn't wait for each decode; only decode_ahead of them are held in memory before they are mixed
+        lazy = [clip for clip in clips if callable(clip.audio) and clip.position < end]
+        decoding: dict[int, Future] = {}  # Samples of clips being decoded ahead, by id of clip
+        next_lazy = 0
+        executor = ThreadPoolExecutor(self.decode_ahead) if lazy and self.decode_ahead else None
+
+        try:
+            for chunk_start in range(0, end, chunk_size):
+                chunk_end = min(chunk_start + chunk_size, end)
+
+                # Update clips that overlap chunk (samples of clips that ended are released)
+                active = [(clip, samples) for clip, samples in active if clip.end > chunk_start]
+                while next_clip < len(clips) and clips[next_clip].position < chunk_end:
+                    if (clip := clips[next_clip]).end > chunk_start:
+                        future = decoding.pop(id(clip), None)
+                        active.append((clip, future.result() if future else self.decode(clip, dtype)))
+                    next_clip += 1
+
+                # Start decoding upcoming clips (once one starts being mixed, the next one starts decoding)
+                while executor and next_lazy < len(lazy) and len(decoding) < self.decode_ahead:
+                    if (clip := lazy[next_lazy]).position >= chunk_end:
+                        decoding[id(clip)] = executor.submit(self.decode, clip, dtype)
+                    next_lazy += 1
+
+                # Sum overlapping clips, saturating like pydub's overlay
+                mix = np.zeros((chunk_end - chunk_start, self.channels), dtype=np.int64)
+                for clip, samples in active:
+                    start, stop = max(chunk_start, clip.position), min(chunk_end, clip.position + len(samples))
+                    if start >= stop:
+                        continue
+                    mix[start - chunk_start: stop - chunk_start] += samples[start - clip.position: stop - clip.position]
+                yield np.clip(mix, info.min, info.max).astype(dtype)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def export(self, path: str, duration: float = None):
+        """ Export timeline to WAV file, mixing one chunk at a time. """
+        with wave.open(path, "wb") as out:
+            out.setnchannels(self.channels)
+            out.setsampwidth(self.sample_width)
+            out.setframerate(self.frame_rate)
+            for chunk in self.chunks(duration):
+                if self.sample_width == 1:
+                    chunk = (chunk.astype(np.int16) + 128).astype(np.uint8)  # 8-bit WAV is unsigned
+                out.writeframes(chunk.tobytes())
@@ -0,0 +1,141 @@
+
+import cv2
+import numpy as np
+import threading
+from abc import ABC, abstractmethod
+
+from app.media import *
+from app.render import *
+
+
+class Transition(ABC):
+    """
+    Transition into a slide from the previous slide, over the first frames of the slide, with the last frame of the
+    previous slide held under it (so only two source frames are in flight).
+    Weights (and masks) of every frame are computed up front, the slide's frame is rendered into a scratch frame of
+    the rendering thread, and the result is blended straight into a preallocated output frame, so rendering a
+    transition frame allocates nothing.
+    """
+
+    def __init__(self, frames: int, width: int, height: int):
+        """
+        :param frames: number of frames of transition
+        :param width: width of frames
+        :param height: height of frames
+        """
+        self.frames = frames
+        self.width = width
+        self.height = height
+        # Progress of each frame, from 0 (previous slide) to 1 (slide), exclusive so every frame is in between
+        self.progress = np.arange(1, frames + 1) / (frames + 1)
+        self.scratch = threading.local()  # Scratch frames of each rendering thread
+
+    @abstractmethod
+    def render(self, i: int, held: np.ndarray, out: np.ndarray, render, *args) -> np.ndarray:
+        """
+        Render frame of transition into out.
+        :param i: index of frame in transition
+        :param held: last frame of previous slide
+        :param out: frame to render into
+        :param render: function that renders frame of slide into dst, called with args (only if the frame needs it)
+        :return: out
+        """
+        pass
+
+    def source(self, render, *args) -> Image:
+        """ Render frame of slide into scratch frame of this thread. """
+        if not hasattr(self.scratch, "frame"):
+            self.scratch.frame = Image(np.empty((self.height, self.width, 3), np.uint8))
+        return render(*args, dst=self.scratch.frame)
+
+
+class Crossfade(Transition):
+    """ Blend previous slide into slide. """
+
+    def __init__(self, frames: int, width: int, height: int):
+        super().__init__(frames, width, height)
+        self.weights = [(1 - p, p) for p in self.progress.tolist()]
+
+    def render(self, i: int, held: np.ndarray, out: np.ndarray, render, *args) -> np.ndarray:
+        held_weight, weight = self.weights[i]
+        cv2.addWeighted(held, held_weight, self.source(render, *args), weight, 0, dst=out)
+        return out
+
+
+class Fade(Transition):
+    """ Fade previous slide out to black, then slide in from black. """
+
+    def __init__(self, frames: int, width: int, height: int):
+        super().__init__(frames, width, height)
+        self.gains = np.abs(2 * self.progress - 1).tolist()
+        self.from_held = (self.progress < 0.5).tolist()
+
+    def render(self, i: int, held: np.ndarray, out: np.ndarray, render, *args) -> np.ndarray:
+        cv2.convertScaleAbs(held if self.from_held[i] else self.source(render, *args), dst=out, alpha=self.gains[i])
+        return out
+
+
+class Blur(Transition):
+    """
+    Blur previous slide out, then blur slide in. Frames are blurred at reduced resolution (and scaled back up), so
+    the cost of a frame does not depend on how blurred it is.
+    """
+
+    scale = 8  # Downscale factor of frames to blur
+    max_blur = 0.1  # Box size of most blurred frame, relative to frame width
+
+    def __init__(self, frames: int, width: int, height: int):
+        super().__init__(frames, width, height)
+        self.small_size = (max(1, width // self.scale), max(1, height // self.scale))
+        strength = 1 - np.abs(2 * self.progress - 1)  # Most blurred halfway through
+        self.kernels = [(k, k) for k in np.maximum(1, np.round(strength * self.max_blur * self.small_size[0]))
+                        .astype(int).tolist()]
+        self.from_held = (self.progress < 0.5).tolist()
+
+    def render(self, i: int, held: np.ndarray, out: np.ndarray, render, *args) -> np.ndarray:
+        if not hasattr(self.scratch, "small"):
+            shape = (self.small_size[1], self.small_size[0], 3)
+            self.scratch.small, self.scratch.blurred = np.empty(shape, np.uint8), np.empty(shape, np.uint8)
+        small, blurred = self.scratch.small, self.scratch.blurred
+        cv2.resize(held if self.from_held[i] else self.source(render, *args), self.small_size, dst=small,
+                   interpolation=cv2.INTER_LINEAR)
+        cv2.blur(small, self.kernels[i], dst=blurred)
+        cv2.resize(blurred, (self.width, self.height), dst=out, interpolation=cv2.INTER_LINEAR)
+        return out
+
+
+class Wipe(Transition):
+    """
+    Wipe slide in from the left, over previous slide, with a soft edge. Only the columns under the edge are blended
+    (with a precomputed mask, in integer arithmetic); the rest are copied from either slide.
+    """
+
+    softness = 0.1  # Width of edge, relative to frame width
+
+    def __init__(self, frames: int, width: int, height: int):
+        super().__init__(frames, width, height)
+        self.soft = max(1, int(width * self.softness))
+        # Left column of edge in each frame (edge moves from just left of frame to just right of it)
+        self.edges = np.round(self.progress * (width + self.soft) - self.soft).astype(int).tolist()
+        # Weights (out of 255) of slide and of previous slide across edge
+        self.mask = np.tile(np.linspace(255, 0, self.soft).astype(np.uint8)[None, :, None], (height, 1, 3))
+        self.held_mask = 255 - self.mask
+
+    def render(self, i: int, held: np.ndarray, out: np.ndarray, render, *args) -> np.ndarray:
+        frame = self.source(render, *args)
+        edge = self.edges[i]
+        left, right = max(edge, 0), min(edge + self.soft, self.width)
+        np.copyto(out[:, :left], frame[:, :left])
+        np.copyto(out[:, right:], held[:, right:])
+        if left < right:
+            if not hasattr(self.scratch, "edge"):
+                self.scratch.edge = np.empty((self.height, self.soft, 3), np.uint8)
+            weighted, strip = self.scratch.edge[:, : right - left], out[:, left: right]
+            cv2.multiply(frame[:, left: right], self.mask[:, left - edge: right - edge], dst=weighted, scale=1 / 255)
+            cv2.multiply(held[:, left: right], self.held_mask[:, left - edge: right - edge], dst=strip, scale=1 / 255)
+            cv2.add(weighted, strip, dst=strip)
+        return out
+
+
+# Transitions by name; "cut" is no transition
+TRANSITIONS: dict[str, type[Transition]] = {"crossfade": Crossfade, "fade": Fade, "blur": Blur, "wipe": Wipe}
@@ -2,6 +2,13 @@
 import subprocess
 import platform
 import os
+import json
+import struct
+import time
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
 def shexecute(cmd):
@@ -15,6 +22,12 @@ def shexecute(cmd):
         raise subprocess.CalledProcessError(return_code, cmd)
 
 
+def probe(path: str) -> dict:
+    """ Return container and stream info of media file from ffprobe, without decoding it. """
+    cmd = ["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path]
+    return json.loads(subprocess.run(cmd, capture_output=True, check=True).stdout)
+
+
 def creation_date(path_to_file):
     """
     Try to get the date that a file was created, falling back to when it was
@@ -32,3 +45,55 @@ def creation_date(path_to_file):
             # so we'll settle for when its content was last modified.
             return stat.st_mtime
 
+
+
+def exif_date(path: str) -> float:
+    """
+    Return date photo was taken (EXIF DateTimeOriginal) as a timestamp in local time, or None if unknown.
+    Only the headers at the start of the JPEG are read.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            # Find EXIF segment (APP1) among the header segments
+            while True:
+                marker = f.read(4)
+                if len(marker) < 4 or marker[0] != 0xFF or marker[1] == 0xDA:  # Start of image data
+                    return None
+                length = int.from_bytes(marker[2:], "big") - 2
+                if marker[1] == 0xE1 and (data := f.read(length)).startswith(b"Exif\0\0"):
+                    break
+                elif marker[1] != 0xE1:
+                    f.seek(length, os.SEEK_CUR)
+
+        # EXIF is a TIFF structure: IFD0 points to EXIF IFD, which holds DateTimeOriginal
+        tiff = data[6:]
+        endian = "<" if tiff[:2] == b"II" else ">"
+
+        def find_tag(ifd: int, tag: int) -> tuple[int, int]:
+            """ Return count and value (or offset of value) of tag in IFD, or None. """
+            n_entries, = struct.unpack_from(endian + "H", tiff, ifd)
+            for i in range(n_entries):
+                entry_tag, _, count, value = struct.unpack_from(endian + "HHII", tiff, ifd + 2 + 12 * i)
+                if entry_tag == tag:
+                    return count, value
+            return None
+
+        ifd0, = struct.unpack_from(endian + "I", tiff, 4)
+        if (exif_ifd := find_tag(ifd0, 0x8769)) is None or (date := find_tag(exif_ifd[1], 0x9003)) is None:
+            return None
+        count, offset = date
+        text = tiff[offset: offset + count].rstrip(b"\0").decode("ascii")
+        return time.mktime(time.strptime(text, "%Y:%m:%d %H:%M:%S"))
+    except (OSError, struct.error, ValueError, OverflowError):
+        return None  # Missing, truncated or malformed EXIF
+
+
+def peak_memory() -> int:
+    """ Return peak resident memory of this process in bytes (0 if unknown). """
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return usage if platform.system() == 'Darwin' else usage * 1024
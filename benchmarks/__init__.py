@@ -0,0 +1 @@
+""" Benchmarks for the movie export pipeline. Run from the root directory, e.g. `python -m benchmarks.timeline`. """
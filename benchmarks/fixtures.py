@@ -0,0 +1,84 @@
+""" Synthetic media for benchmarks: images, video clips and music, generated locally (and a null video writer). """
+
+import cv2
+import numpy as np
+from pydub import AudioSegment
+import os
+
+from app.media import *
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image:
+    """ Generate detailed test image. """
+    rng = np.random.default_rng(seed)
+    img = cv2.resize(rng.integers(0, 255, (height // 50, width // 50, 3), dtype=np.uint8), (width, height))
+    for i in range(0, width, 100):
+        cv2.line(img, (i, 0), (width - i, height), (255, 255, 255), 5)
+    return Image(img)
+
+
+def synthetic_audio(seconds: float, frequency: float, frame_rate: int = 44100, channels: int = 2) -> AudioSegment:
+    """ Generate sine tone as AudioSegment. """
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    samples = (0.3 * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)
+    data = np.repeat(samples[:, None], channels, axis=1).tobytes()
+    return AudioSegment(data=data, sample_width=2, frame_rate=frame_rate, channels=channels)
+
+
+def click_track(seconds: float, bpm: float = 120, frame_rate: int = 44100, channels: int = 2) -> AudioSegment:
+    """ Generate quiet tone with a loud click on every beat (so beats are easy to detect). """
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    signal = 0.05 * np.sin(2 * np.pi * 220 * t)
+    click = 0.8 * np.sin(2 * np.pi * 1000 * t[:frame_rate // 20])
+    for beat in np.arange(0, seconds, 60 / bpm):
+        start = int(beat * frame_rate)
+        signal[start: start + len(click)] += click[:len(signal) - start]
+    samples = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    data = np.repeat(samples[:, None], channels, axis=1).tobytes()
+    return AudioSegment(data=data, sample_width=2, frame_rate=frame_rate, channels=channels)
+
+
+def write_images(directory: str, count: int, width: int, height: int, interval: float = 60) -> list[str]:
+    """
+    Write JPEGs of varying aspect ratios, named sequentially.
+    :param interval: seconds between modification times of consecutive images (used as their creation dates)
+    :return: paths of images
+    """
+    os.makedirs(directory, exist_ok=True)
+    sizes = [(width, height), (height, width), (width, height * 2 // 3)]  # Landscape, portrait, panorama
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i + 1}.jpg")
+        cv2.imwrite(path, synthetic_image(*sizes[i % len(sizes)], seed=i))
+        os.utime(path, (i * interval, i * interval))
+        paths.append(path)
+    return paths
+
+
+def write_videos(directory: str, count: int, width: int, height: int, fps: int = 30, seconds: float = 3,
+                 first: int = 1) -> list[str]:
+    """
+    Write MP4 clips (video only) with OpenCV, named sequentially from first.
+    :return: paths of videos
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{first + i}.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        background = synthetic_image(width, height, seed=first + i)
+        for k in range(int(fps * seconds)):
+            writer.write(np.roll(background, k * 8, axis=1))  # Scroll, so every frame is different
+        writer.release()
+        paths.append(path)
+    return paths
+
+
+class NullWriter:
+    """ Video writer that only copies frames into contiguous memory (as piping them to ffmpeg does). """
+
+    def write(self, frame):
+        np.ascontiguousarray(frame)
+
+    def release(self):
+        pass
@@ -0,0 +1,79 @@
+""" Benchmark allocations of the frame path: new frames every frame vs. rendering into reused output frames. """
+
+import cv2
+import numpy as np
+import time
+import tracemalloc
+import click
+
+from app.media import *
+from app.render import *
+from app.transitions import *
+from benchmarks.fixtures import *
+
+
+def measure(render_frame, frames: int) -> tuple[float, float]:
+    """
+    Render (and write) frames by calling render_frame(i) for each; return frames per second, and mean number of
+    bytes allocated per frame (peak of memory traced by tracemalloc while rendering the frame).
+    """
+    render_frame(0)  # Warm up (e.g. allocate reused frames)
+    start = time.perf_counter()
+    for i in range(frames):
+        render_frame(i)
+    fps = frames / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    peaks = []
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        render_frame(i)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    return fps, float(np.mean(peaks))
+
+
+@click.command()
+@click.option("--width", "-w", default=1920, help="Width of output video.")
+@click.option("--height", "-h", default=1080, help="Height of output video.")
+@click.option("--video-size", default=(2560, 1440), type=(int, int), help="Size of synthetic video frames.")
+@click.option("--frames", default=60, help="Number of frames to render per case.")
+def main(width, height, video_size, frames):
+    pan = ImageSlide(synthetic_image(4000, 1500, seed=1), width, height, 1.1, 0.08, True, False, 0.3, 0.7)
+    zoom = ImageSlide(synthetic_image(3000, 2000, seed=0), width, height, 1.1, 0.08, False, False, 0.3, 0.7)
+    video_frame = synthetic_image(*video_size, seed=2)
+    held = np.ascontiguousarray(pan.render(1))
+    crossfade = Crossfade(frames, width, height)
+    pcts = np.linspace(0, 1, frames)
+
+    # Allocating path: every frame is a new array (or a view, copied when written)
+    writer = NullWriter()
+    allocating = {
+        "pan": lambda i: writer.write(pan.render(pcts[i])),
+        "zoom": lambda i: writer.write(zoom.render(pcts[i])),
+        "video": lambda i: writer.write(crop_to_fill(video_frame, width, height)),
+        "crossfade": lambda i: writer.write(cv2.addWeighted(held, 1 - pcts[i], zoom.render(pcts[i]), pcts[i], 0)),
+    }
+
+    # Reusing path: frames are rendered into output frames from a pool, which are given back once written
+    frame_pool = FramePool(width, height)
+    pool = RenderPool(NullWriter(), recycle=frame_pool.give)
+    reusing = {
+        "pan": lambda i: pool.submit(pan.render, pcts[i], frame_pool.take()),
+        "zoom": lambda i: pool.submit(zoom.render, pcts[i], frame_pool.take()),
+        "video": lambda i: pool.submit(crop_to_fill, video_frame, width, height, frame_pool.take()),
+        "crossfade": lambda i: pool.submit(crossfade.render, i, held, frame_pool.take(), zoom.render, pcts[i]),
+    }
+
+    frame_size = width * height * 3
+    print(f"{frames} frames per case at {width}x{height} ({frame_size / 1024**2:.1f} MB per frame)")
+    for name in allocating:
+        for path, cases in [("allocating", allocating), ("reusing", reusing)]:
+            fps, allocated = measure(cases[name], frames)
+            print(f"  {name:<10} {path:<11} {fps:8.1f} fps  {allocated / 1024:10.1f} KB allocated per frame "
+                  f"({allocated / frame_size:.2f} frames)")
+
+
+if __name__ == "__main__":
+    main()
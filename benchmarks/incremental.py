@@ -0,0 +1,52 @@
+""" Check that incremental renders reuse the segments of unchanged slides after a photo is inserted or removed. """
+
+import os
+import tempfile
+import time
+import click
+
+from app.movie import *
+from benchmarks.fixtures import *
+
+
+@click.command()
+@click.option("--images", default=40, help="Number of images in first render.")
+@click.option("--at", default=5, help="Index to insert a photo at, and then remove it from.")
+@click.option("--transition", "-t", default="crossfade", type=click.Choice(["cut", *TRANSITIONS]),
+              help="Transition between slides.")
+@click.option("--max-rendered", default=3, help="Max number of slides to re-render after each edit.")
+def main(images, at, transition, max_rendered):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_images(os.path.join(tmp, "media"), images + 1, 480, 320)
+        inserted = paths.pop(at)
+        cache = MediaCache(os.path.join(tmp, "cache"))
+        music = click_track(60)
+        beats = [Beats.from_audio(music)]
+        out = os.path.join(tmp, "out.mp4")
+        store = SegmentStore(os.path.join(tmp, "segments"))
+
+        def render(paths: list[str]) -> tuple[int, int]:
+            """ Render movie of images incrementally; return number of slides re-rendered, and of slides. """
+            before = set((store.load(out) or (None, []))[1])
+            movie = Movie([ImageFile(path) for path in paths], [music], 320, 180, 10, beats=beats, cache=cache,
+                          segment_dir=store.directory, transition=transition)
+            start = time.perf_counter()
+            movie.export(out, incremental=True)
+            segments = store.load(out)[1]
+            rendered = len(set(segments) - before)
+            print(f"  {len(paths)} images: re-rendered {rendered} of {len(segments)} slides "
+                  f"in {time.perf_counter() - start:.2f}s, {len(os.listdir(store.directory)) - 1} segments stored")
+            return rendered, len(segments)
+
+        print(f"First render, then insert photo at {at}, then remove it again ({transition} transitions)")
+        render(paths)
+        edits = {"insert": render(paths[:at] + [inserted] + paths[at:]), "remove": render(paths)}
+        cache.close()
+
+    over = [name for name, (rendered, _) in edits.items() if rendered > max_rendered]
+    if over:
+        raise click.ClickException(f"Re-rendered more than {max_rendered} slides after: {', '.join(over)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+""" Check that the memory budget bounds decoded images alive while rendering, however deep the prefetch is. """
+
+import os
+import tempfile
+import time
+import tracemalloc
+import click
+
+from app.movie import *
+from benchmarks.fixtures import *
+
+
+def render_peak(files: list[ImageFile], music: AudioSegment, cache: MediaCache, path: str, budget: int,
+                prefetch: int) -> tuple[float, int, int]:
+    """ Render movie of images; return seconds taken, peak of memory traced by tracemalloc, and peak reserved. """
+    movie = Movie(files, [music], 320, 180, 10, cache=cache, memory_budget=MemoryBudget(budget),
+                  min_duration_img=500, min_duration_last=500)
+    plan = movie.plan()  # (not measured: music analysis)
+    tracemalloc.start()
+    start = time.perf_counter()
+    movie.render(plan, path, prefetch=prefetch)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, movie.memory_budget.peak
+
+
+@click.command()
+@click.option("--images", default=12, help="Number of images.")
+@click.option("--image-size", default=(4000, 3000), type=(int, int), help="Size of images.")
+@click.option("--prefetch", default=8, help="Number of slides to decode ahead of the one being rendered.")
+@click.option("--budget", default=48, help="Small memory budget to check, in MB.")
+@click.option("--slack", default=16, help="Memory allowed beyond budget and one decoded image (e.g. frames), in MB.")
+def main(images, image_size, prefetch, budget, slack):
+    image_bytes = image_size[0] * image_size[1] * 3
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [ImageFile(path) for path in write_images(os.path.join(tmp, "media"), images, *image_size)]
+        cache = MediaCache(os.path.join(tmp, "cache"))
+        music = click_track(images * 2)
+        print(f"{images} images of {image_size[0]}x{image_size[1]} ({image_bytes / 1024**2:.0f} MB decoded), "
+              f"prefetch {prefetch}")
+
+        limit = budget * 1024**2 + image_bytes + slack * 1024**2
+        for name, case_budget in [("unbounded", 100 * images * image_bytes), ("budget", budget * 1024**2)]:
+            seconds, peak, reserved = render_peak(files, music, cache, os.path.join(tmp, "out.mp4"), case_budget,
+                                                  prefetch)
+            print(f"  {name:<10} {seconds:6.2f}s  peak {peak / 1024**2:6.0f} MB traced, "
+                  f"{reserved / 1024**2:6.0f} MB of decoded images reserved")
+        cache.close()
+
+    if peak > limit:
+        raise click.ClickException(f"Peak memory {peak / 1024**2:.0f} MB is over {limit / 1024**2:.0f} MB "
+                                   f"(budget, one image and slack)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+""" Benchmark each stage of the export pipeline separately, on synthetic media, and report results as JSON. """
+
+import cv2
+import numpy as np
+import os
+import time
+import json
+import tempfile
+from contextlib import contextmanager
+import click
+
+from config import *
+from app.util import *
+from app.media import *
+from app.beats import *
+from app.schedule import *
+from app.timeline import *
+from app.render import *
+from app.output import *
+from app.cache import *
+from app.movie import *
+from app.scan import *
+from benchmarks.fixtures import *
+
+
+class Stages:
+    """ Timings of benchmarked stages, with throughput and peak memory of each. """
+
+    def __init__(self):
+        self.results: dict[str, dict] = {}
+
+    @contextmanager
+    def stage(self, name: str, items: int, unit: str):
+        """ Time stage that processes given number of items (e.g. frames). """
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        rate = items / seconds if seconds else float("inf")  # Items per second (fps for frames)
+        self.results[name] = {
+            "seconds": seconds,
+            "items": items,
+            "unit": unit,
+            "rate": rate,
+            "peak_memory": peak_memory(),  # Peak of whole process so far, in bytes
+        }
+        print(f"  {name:<36} {seconds:8.3f}s  {rate:10.1f} {unit}/s  "
+              f"(peak memory {peak_memory() / 1024**2:.0f} MB)")
+
+
+@click.command()
+@click.option("--images", default=60, help="Number of synthetic images.")
+@click.option("--image-size", default=(4000, 3000), type=(int, int), help="Size of synthetic images.")
+@click.option("--videos", default=3, help="Number of synthetic video clips.")
+@click.option("--video-size", default=(1920, 1080), type=(int, int), help="Size of synthetic video clips.")
+@click.option("--video-seconds", default=3.0, help="Duration of each video clip in seconds.")
+@click.option("--music-seconds", default=120.0, help="Duration of synthetic music in seconds.")
+@click.option("--width", "-w", default=1920, help="Width of output video.")
+@click.option("--height", "-h", default=1080, help="Height of output video.")
+@click.option("--fps", "-f", default=30, help="FPS of output video.")
+@click.option("--frames", default=90, help="Number of frames to render, encode and mux per stage.")
+@click.option("--json", "json_path", default=None, help="File to write results to as JSON.")
+def main(images, image_size, videos, video_size, video_seconds, music_seconds, width, height, fps, frames,
+         json_path):
+    stages = Stages()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Generate fixtures (not timed)
+        print(f"Generating {images} images, {videos} videos and {music_seconds:.0f}s of music in {tmp}")
+        media_dir = os.path.join(tmp, "media")
+        write_images(media_dir, images, *image_size)
+        write_videos(media_dir, videos, *video_size, fps=fps, seconds=video_seconds, first=images + 1)
+        music = click_track(music_seconds)
+        cache = MediaCache(os.path.join(tmp, "cache"))
+        print(f"Benchmarking at {width}x{height}, {fps} fps")
+
+        # Scan directory and read creation dates, with the same scanner as the app
+        with stages.stage("scan", images + videos, "files"):
+            files = scan_media(media_dir)
+
+        with stages.stage("cluster_files_by_date", len(files), "files"):
+            clusters = cluster_files_by_date(files)
+
+        with stages.stage("choose_representatives", len(files), "files"):
+            chosen = [file for cluster in clusters for file in choose_representatives(cluster)]
+
+        # Sharpness of every image is computed on a cold cache, so this includes decoding them
+        with stages.stage("choose_representatives_by_laplacian", len(files), "files"):
+            chosen = [file for cluster in clusters for file in choose_representatives_by_laplacian(cluster, cache)]
+
+        # Sharpness, exposure and faces of every image, from reduced-resolution decodes, on a cold cache
+        image_files = [file for file in files if isinstance(file, ImageFile)]
+        with stages.stage("score_images", len(image_files), "files"):
+            score_images(image_files, cache)
+
+        # Onsets, tempo and beat grid of the music
+        with stages.stage("beat_detection", int(music_seconds), "music seconds"):
+            beats = Beats.from_audio(music)
+
+        # Timing of a slide per beat of the music, on average
+        n_slides = len(beats.times)
+        with stages.stage("schedule_slides", n_slides, "slides"):
+            max_frames = np.full(n_slides, 10 * fps)
+            strengths = np.zeros(max_frames.sum() + 1)
+            times, beat_strengths = beat_grid([beats], max_frames.sum() * 1000 / fps)
+            beat_frames = np.ceil(times * fps / 1000).astype(np.int64)
+            in_range = beat_frames < len(strengths)
+            strengths[beat_frames[in_range]] = np.maximum(beat_strengths[in_range], 1e-3)
+            schedule_slides(np.full(n_slides, fps // 3), max_frames, strengths, 0.1 / fps, 1)
+
+        # Per-frame rendering, including the one-time downscale of each slide's image
+        img = ImageFile(os.path.join(media_dir, "1.jpg"))
+        img.load()
+        panorama = ImageFile(os.path.join(media_dir, "3.jpg"))
+        panorama.load()
+        rendered = []
+        for name, source, pan_x in [("render_pan", panorama, True), ("render_zoom", img, False)]:
+            with stages.stage(name, frames, "frames"):
+                slide = ImageSlide(next(source), width, height, 1.1, 0.08, pan_x, False, 0.3, 0.7)
+                rendered = [slide.render(pct) for pct in np.linspace(0, 1, frames)]
+
+        video = VideoFile(os.path.join(media_dir, f"{images + 1}.mp4"))
+        video.load()
+        with stages.stage("render_video", frames, "frames"):
+            for _ in range(frames):
+                if (next_frame := next(video, None)) is None:
+                    video.set_frame(0)
+                    next_frame = next(video)
+                crop_to_fill(next_frame, width, height)
+        video.unload()
+
+        # Encode video only, then mux it with the music (without re-encoding video)
+        encoded = os.path.join(tmp, "encoded.mp4")
+        with stages.stage("encoding", frames, "frames"):
+            writer = FFmpegWriter(encoded, width, height, fps)
+            for frame in rendered:
+                writer.write(frame)
+            writer.release()
+
+        timeline = Timeline()
+        timeline.append(music)
+        with stages.stage("muxing", frames, "frames"):
+            concat_segments(os.path.join(tmp, "muxed.mp4"), [encoded], timeline, duration=frames * 1000 / fps)
+        cache.close()
+
+    results = {
+        "config": dict(images=images, image_size=image_size, videos=videos, video_size=video_size,
+                       video_seconds=video_seconds, music_seconds=music_seconds, width=width, height=height,
+                       fps=fps, frames=frames),
+        "stages": stages.results,
+        "peak_memory": peak_memory(),
+    }
+    print(f"Peak memory usage: {peak_memory() / 1024**2:.0f} MB")
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
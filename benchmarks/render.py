@@ -0,0 +1,53 @@
+""" Benchmark rendering image slides: per-frame resize of the full image vs. precomputed ImageSlide warps. """
+
+import cv2
+import numpy as np
+import time
+import click
+
+from app.media import *
+from app.render import *
+from benchmarks.fixtures import *
+
+
+def render_resize(img: Image, width, height, prepan_scale, zoom_pct, pan_x, pan_y, r1, r2, pct) -> Image:
+    """ Render frame the old way, resizing the full image every frame. """
+    frame = img.resize_to_contain(int(width * prepan_scale), int(height * prepan_scale))
+    if pan_x:
+        return frame.pan(pct, 0, width, height)
+    elif pan_y:
+        return frame.pan(0, pct, width, height)
+    frame = frame.pan(r1 * pct, r2 * pct, width, height)
+    return frame.zoom(1 - zoom_pct * pct)
+
+
+@click.command()
+@click.option("--width", "-w", default=1920, help="Width of output video.")
+@click.option("--height", "-h", default=1080, help="Height of output video.")
+@click.option("--frames", default=90, help="Number of frames per slide.")
+def main(width, height, frames):
+    params = dict(width=width, height=height, prepan_scale=1.1, zoom_pct=0.08, r1=0.3, r2=0.7)
+    cases = {
+        "pan (24 MP, wide)": (synthetic_image(8000, 3000), True, False),
+        "zoom (24 MP, 3:2)": (synthetic_image(6000, 4000), False, False),
+    }
+    print(f"{frames} frames at {width}x{height}")
+    for name, (img, pan_x, pan_y) in cases.items():
+        pcts = np.linspace(0, 1, frames)
+
+        start = time.perf_counter()
+        before = [render_resize(img, pan_x=pan_x, pan_y=pan_y, pct=pct, **params) for pct in pcts]
+        before_fps = frames / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        slide = ImageSlide(img, pan_x=pan_x, pan_y=pan_y, **params)
+        after = [slide.render(pct) for pct in pcts]
+        after_fps = frames / (time.perf_counter() - start)
+
+        diff = np.mean([np.abs(a.astype(int) - b.astype(int)).mean() for a, b in zip(before, after)])
+        print(f"  {name}: {before_fps:7.1f} fps before, {after_fps:7.1f} fps after "
+              f"({after_fps / before_fps:.1f}x), mean abs difference {diff:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" Benchmark mixing music with many overlaid clips: pydub overlay vs. lazy Timeline. """
+
+import numpy as np
+from pydub import AudioSegment
+import os
+import time
+import tempfile
+import click
+
+from app.timeline import *
+from benchmarks.fixtures import *
+
+
+@click.command()
+@click.option("--tracks", default=3, help="Number of music tracks.")
+@click.option("--track-seconds", default=180, help="Duration of each music track in seconds.")
+@click.option("--overlays", default=200, help="Number of overlaid clips.")
+@click.option("--overlay-seconds", default=3, help="Duration of each overlaid clip in seconds.")
+def main(tracks, track_seconds, overlays, overlay_seconds):
+    musics = [synthetic_audio(track_seconds, 220 * (i + 1)) for i in range(tracks)]
+    clip = synthetic_audio(overlay_seconds, 880)
+    duration = tracks * track_seconds * 1000
+    positions = np.linspace(0, duration - overlay_seconds * 1000, overlays).astype(int)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # pydub: concatenate and overlay, copying the whole soundtrack each time
+        start = time.perf_counter()
+        music = musics[0]
+        for m in musics[1:]:
+            music += m
+        for position in positions:
+            music = music.overlay(clip, position=position)
+        music[0: duration].export(pydub_path := os.path.join(tmp, "pydub.wav"), format="wav")
+        pydub_time = time.perf_counter() - start
+
+        # Timeline: refer to audio by offset, mix once on export
+        start = time.perf_counter()
+        timeline = Timeline()
+        for m in musics:
+            timeline.append(m)
+        for position in positions:
+            timeline.overlay(clip, position)
+        timeline.export(timeline_path := os.path.join(tmp, "timeline.wav"), duration=duration)
+        timeline_time = time.perf_counter() - start
+
+        same = AudioSegment.from_file(pydub_path).raw_data == AudioSegment.from_file(timeline_path).raw_data
+
+    print(f"{tracks} x {track_seconds}s tracks, {overlays} x {overlay_seconds}s overlays")
+    print(f"  pydub:    {pydub_time:8.3f}s")
+    print(f"  Timeline: {timeline_time:8.3f}s  ({pydub_time / timeline_time:.1f}x faster)")
+    print(f"  Identical output: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+""" Benchmark rendering a sequence of slides with each transition, against hard cuts between them. """
+
+import numpy as np
+import os
+import time
+import click
+
+from app.media import *
+from app.render import *
+from app.transitions import *
+from benchmarks.fixtures import *
+
+
+def render_slides(slides: list[ImageSlide], frames: int, transition: Transition | None, workers: int) -> float:
+    """ Render frames of slides (with transition into every slide after the first); return seconds taken. """
+    frame_pool = FramePool(slides[0].width, slides[0].height)
+    pool = RenderPool(NullWriter(), workers, recycle=frame_pool.give)
+    start = time.perf_counter()
+    held = None
+    for slide in slides:
+        for i, pct in enumerate(np.linspace(0, 1, frames)):
+            if held is not None and transition is not None and i < transition.frames:
+                pool.submit(transition.render, i, held, frame_pool.take(), slide.render, pct)
+            else:
+                pool.submit(slide.render, pct, frame_pool.take())
+        held = np.ascontiguousarray(slide.render(1))
+    pool.close()
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--width", "-w", default=1920, help="Width of output video.")
+@click.option("--height", "-h", default=1080, help="Height of output video.")
+@click.option("--fps", "-f", default=30, help="FPS of output video.")
+@click.option("--slides", default=8, help="Number of slides.")
+@click.option("--slide-duration", default=1500, help="Duration of each slide in ms.")
+@click.option("--transition-duration", default=300, help="Duration of transitions in ms.")
+@click.option("--workers", "-j", default=1, help="Number of threads to render frames on.")
+@click.option("--repeat", default=5, help="Number of times to render each case (the fastest time is kept).")
+@click.option("--max-overhead", default=0.2, help="Max extra render time of transitions, relative to cuts.")
+def main(width, height, fps, slides, slide_duration, transition_duration, workers, repeat, max_overhead):
+    frames = slide_duration * fps // 1000
+    transition_frames = transition_duration * fps // 1000
+    # Alternate zoomed (3:2) and panned (wide) slides; images are downscaled up front, as when prefetched
+    images = [synthetic_image(3000, 2000, seed=0), synthetic_image(4000, 1500, seed=1)]
+    image_slides = [ImageSlide(images[i % 2], width, height, 1.1, 0.08, i % 2 == 1, False, 0.3, 0.7)
+                    for i in range(slides)]
+    print(f"{slides} slides of {frames} frames at {width}x{height}, transitions of {transition_frames} frames, "
+          f"{workers} worker(s)")
+
+    # Cases are interleaved, so that they are all equally affected by changing load on the machine
+    cases = {"cut": None, **{name: kind(transition_frames, width, height) for name, kind in TRANSITIONS.items()}}
+    times = {name: float("inf") for name in cases}
+    for _ in range(repeat):
+        for name, transition in cases.items():
+            times[name] = min(times[name], render_slides(image_slides, frames, transition, workers))
+
+    over_budget = []
+    for name, seconds in times.items():
+        overhead = seconds / times["cut"] - 1
+        print(f"  {name:<10} {seconds:7.3f}s  {slides * frames / seconds:7.1f} fps  {100 * overhead:+6.1f}% vs cut")
+        if overhead > max_overhead:
+            over_budget.append(name)
+
+    if over_budget:
+        raise click.ClickException(f"Over {100 * max_overhead:.0f}% overhead: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
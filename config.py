@@ -6,9 +6,16 @@ DATADIR = os.path.join(basedir, "data")  # directory to store data
 AUDIODIR = os.path.join(DATADIR, "audio")  # directory containing music files
 MEDIADIR = os.path.join(DATADIR, "media")  # directory containing photos (jpg/jpeg) and videos (mp4)
 OUTDIR = os.path.join(DATADIR, "out")  # directory to store output files
+CACHEDIR = os.path.join(DATADIR, "cache")  # directory to store cached analysis of input files
+BEATSDIR = os.path.join(CACHEDIR, "beats")  # directory to store beats detected in music files
+SEGMENTDIR = os.path.join(CACHEDIR, "segments")  # directory to store encoded segments of movies, for re-rendering
 
-# TODO: What to do with this?
-STORE_RES = (800, 600)   # resolution to store images for processing (so zooming is full quality, etc)
+# Resolution to store images for rendering, relative to the (pre-panned) movie resolution. Images are downscaled
+# to this once per slide, with enough headroom that zooming is still full quality
+STORE_SCALE = 1.25
+
+# Max bytes of decoded images to keep in memory while rendering (e.g. prefetched images)
+MEMORY_BUDGET = 2 * 1024**3
 
 # Movie Parameters
 MIN_IMAGE_DURATION = 0.3